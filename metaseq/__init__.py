@@ -3,7 +3,7 @@ import sys
 import time
 import helpers
 from helpers import data_dir, example_filename
-from _genomic_signal import genomic_signal
+from _genomic_signal import genomic_signal, multi_array, MergedSignal
 import plotutils
 import integration
 import integration.chipseq
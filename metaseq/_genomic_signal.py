@@ -26,7 +26,8 @@ classes delegate their local_coverage methods to the
 
 import os
 import sys
-import subprocess
+import itertools
+import multiprocessing
 
 import numpy as np
 from bx.bbi.bigwig_file import BigWigFile
@@ -34,9 +35,11 @@ from bx.bbi.bigwig_file import BigWigFile
 import pybedtools
 
 from array_helpers import _array, _array_parallel, _local_coverage, \
-    _local_count, _count_array, _count_array_parallel
+    _local_count, _count_array, _count_array_parallel, _multi_array, \
+    _multi_array_parallel, _bam_read_count_star, ArgumentError
 import filetype_adapters
 import helpers
+from lazyarray import LazyArray
 from helpers import rebin
 
 
@@ -47,7 +50,7 @@ def supported_formats():
     return _registry.keys()
 
 
-def genomic_signal(fn, kind):
+def genomic_signal(fn, kind, **kwargs):
     """
     Factory function that makes the right class for the file format.
 
@@ -58,6 +61,9 @@ def genomic_signal(fn, kind):
     :param kind:
         String.  Format of the file; see
         metaseq.genomic_signal._registry.keys()
+
+    Additional keyword arguments are passed to the class, e.g., read filters
+    for :class:`BamSignal`.
     """
     try:
         klass = _registry[kind.lower()]
@@ -65,11 +71,121 @@ def genomic_signal(fn, kind):
         raise ValueError(
             'No support for %s format, choices are %s'
             % (kind, _registry.keys()))
-    m = klass(fn)
+    m = klass(fn, **kwargs)
     m.kind = kind
     return m
 
 
+def multi_array(signals, features, processes=None, chunksize=1,
+                scale_factors=None, **kwargs):
+    """
+    Creates a 3-D NumPy array of genomic signal from many genomic signal
+    objects for the same features, with shape (len(signals), len(features),
+    bins).
+
+    This is equivalent to stacking `signal.array(features, **kwargs)` for
+    each signal, but the features are only parsed and chunked once, and each
+    chunk of features is handled by a single task that opens all of the
+    signals.  When run in parallel the result is assembled in shared memory.
+
+    Parameters
+    ----------
+    signals : list
+        Genomic signal objects, e.g., as created by :func:`genomic_signal`.
+
+    features : iterable of interval-like objects
+        See the `array` method of genomic signal objects.
+
+    processes, chunksize
+        See the `array` method of genomic signal objects.
+
+    scale_factors : None or list
+        If not None, one number per signal.  The rows for each signal are
+        multiplied in place by the corresponding factor, e.g., to normalize
+        each sample to reads per million mapped reads.
+
+    Notes
+    -----
+    `bins` is required, since all rows must have the same number of columns.
+    Additional keyword args are passed to local_coverage() for every signal.
+    """
+    bins = kwargs.get('bins')
+    if bins is None:
+        raise ArgumentError("multi_array requires bins")
+    if kwargs.get('split_strands', False) or \
+            isinstance(kwargs.get('function'), (list, tuple)) or \
+            kwargs.get('group_by_tag'):
+        raise ArgumentError(
+            "multi_array does not support split_strands, group_by_tag or "
+            "multiple functions")
+    if isinstance(bins, int):
+        ncols = bins
+    else:
+        ncols = sum(bins)
+    if scale_factors is not None and len(scale_factors) != len(signals):
+        raise ArgumentError(
+            "scale_factors must have same length as signals")
+
+    if kwargs.get('target_reads') is not None and not all(
+            isinstance(signal, BamSignal) for signal in signals):
+        raise ArgumentError("target_reads only supported for BAM")
+    specs = []
+    for signal in signals:
+        # Keyword args particular to this signal, e.g., the read filters
+        # a BamSignal was created with (which are lost when the file is
+        # re-opened from its filename) and `target_reads` as a subsample.
+        signal_kwargs = dict(kwargs)
+        if isinstance(signal, BamSignal):
+            signal_kwargs = signal._with_read_filters(signal_kwargs)
+        specs.append((signal.fn, signal.__class__, dict(
+            (key, value) for key, value in signal_kwargs.items()
+            if key not in kwargs or kwargs[key] is not value)))
+    kwargs.pop('target_reads', None)
+    features = [
+        [helpers.tointerval(i) for i in f] if isinstance(f, (list, tuple))
+        else helpers.tointerval(f)
+        for f in features]
+    shape = (len(specs), len(features), ncols)
+
+    if processes is not None:
+        return _multi_array_parallel(
+            specs, features, shape, processes=processes, chunksize=chunksize,
+            scale_factors=scale_factors, **kwargs)
+    out = np.empty(shape)
+    return _multi_array(
+        specs, features, out, scale_factors=scale_factors, **kwargs)
+
+
+def _scale_factor(signal, normalize):
+    """
+    The number to multiply the rows of an array of `signal` by to apply the
+    normalization `normalize` (see :meth:`BaseSignal.array`), or None if
+    there is nothing to do.
+    """
+    if normalize is None:
+        return None
+    if normalize == 'rpm':
+        if not hasattr(signal, 'mapped_read_count'):
+            raise ArgumentError(
+                "normalize='rpm' is only supported for signals with "
+                "a mapped read count, e.g., BAM")
+        return 1e6 / signal.mapped_read_count()
+    raise ArgumentError(
+        "normalize must be None or 'rpm', got %r" % (normalize,))
+
+
+def _control_read_filters(control):
+    """
+    Keyword args that replace any read filters of the signal being
+    normalized when creating the rows of `control`: the filters `control`
+    was created with, if it is a BamSignal, or none.
+    """
+    filters = dict(min_mapq=None, require_flags=None, exclude_flags=None)
+    if isinstance(control, BamSignal):
+        filters.update(control.read_filters)
+    return filters
+
+
 class BaseSignal(object):
     """
     Base class to represent objects from which genomic signal can be
@@ -83,7 +199,9 @@ class BaseSignal(object):
         self.fn = fn
 
     def array(self, features, processes=None, chunksize=1, ragged=False,
-              **kwargs):
+              normalize=None, control=None, comparefunc=np.subtract,
+              transform=None, lazy=False, reduce=None, subset_by=None,
+              min_total=None, min_max=None, where=None, **kwargs):
         """
         Creates an MxN NumPy array of genomic signal for the region defined by
         each feature in `features`, where M=len(features) and N=(bins or
@@ -111,17 +229,185 @@ class BaseSignal(object):
             supplying `bins` or if all features are of uniform length.  If
             True, then return a list of 1-D NumPy arrays
 
+        split_strands : bool
+            If True, then plus- and minus-strand signal is computed in
+            a single pass and a 3-D array of shape (2, len(features), bins)
+            is returned, where the first item is the plus-strand array and
+            the second is the minus-strand array (as would be created with
+            read_strand="+" and read_strand="-" respectively).  With
+            `ragged=True`, each item in the returned list is a 2-row array.
+
+        function : str or list
+            For bigWig files, the statistic to compute for each bin.  If
+            a list of statistics (e.g., ["mean", "max", "coverage"]), then
+            they are all computed in the same pass over the file and a dict
+            of 2-D arrays, keyed by statistic, is returned.
+
+        group_by_tag, groups
+            For BAM files, split reads by the value of a SAM tag (e.g.,
+            group_by_tag="CB" for cell barcodes) while reading each region
+            once.  A 3-D array of shape (len(groups), len(features), bins) is
+            returned, where each item is the array for one of `groups`.  With
+            `ragged=True`, each item in the returned list is
+            a len(groups)-row array.
+
+        normalize : None or "rpm"
+            If "rpm", then scale the signal to reads per million mapped
+            reads (see the `mapped_read_count` method of BAM signals).
+
+        control : None or genomic signal object
+            If not None, then an array for `control` (e.g., the input of
+            a ChIP-seq experiment) is created with the same arguments,
+            normalized in the same way using its own read count, and
+            combined with this signal as comparefunc(this, control).  The
+            control's rows use the read filters it was created with (as
+            does its read count) rather than those of this signal.
+
+        comparefunc : function
+            Function used to combine rows of this signal and of `control`;
+            the default of np.subtract subtracts the control.
+
+        transform : None or function
+            If not None, a function applied to each normalized row, e.g.,
+            :func:`metaseq.plotutils.nice_log`.  With `processes`,
+            `comparefunc` and `transform` must be picklable (not lambdas).
+
+        lazy : bool
+            If True, then return a :class:`metaseq.lazyarray.LazyArray`
+            instead, which records further operations and only creates the
+            array, a chunk of rows at a time, when it is consumed.  Requires
+            `bins`; `chunksize` is not used (see the `chunksize` attribute
+            of the returned object instead).
+
+        reduce : None or "meanvar"
+            If "meanvar", then instead of the array return
+            a :class:`metaseq.lazyarray.Metagene` with the number of rows and
+            the column-wise mean (the average profile) and variance of the
+            array.  These are computed for each chunk of features as it is
+            created (by the workers, if using `processes`), so only O(bins)
+            values per chunk are kept.  Has the same requirements as
+            `lazy=True`.
+
+        subset_by : None or array-like
+            Only used with `reduce`.  One label per feature; if given,
+            a dictionary of label -> Metagene for the features with each
+            label is returned instead, e.g., for the per-cluster average
+            profiles plotted by :func:`metaseq.plotutils.imshow`.
+
+        min_total, min_max : None or float
+            If not None, only keep features whose row has a total (or
+            maximum) of at least this value.  With `split_strands`, each
+            strand must pass.
+
+        where : None or function
+            If not None, only keep features for which where(row) is True,
+            where `row` is 1-D (or 2-D, one row per strand, with
+            `split_strands`).  Must be picklable (not a lambda) when using
+            `processes`.
+
+            If any of `min_total`, `min_max` or `where` are given, rows are
+            tested as they are created (by the workers, if using
+            `processes`) after any normalization, and (indices, array) is
+            returned where `indices` are the positions in `features` of the
+            kept rows.  Not supported with `lazy`, `reduce`, `group_by_tag`
+            or multiple functions.
+
         Notes
         -----
         Additional keyword args are passed to local_coverage() which performs
         the work for each feature; see that method for more details.
+
+        Normalization is done for each chunk of features as it is created
+        (by the workers, if using `processes`), so the un-normalized arrays
+        are never created in full.
         """
+        if normalize is not None or control is not None or \
+                transform is not None:
+            kwargs['scale'] = _scale_factor(self, normalize)
+            kwargs['transform'] = transform
+            if control is not None:
+                kwargs['control'] = (
+                    control.fn, control.__class__,
+                    _scale_factor(control, normalize),
+                    _control_read_filters(control))
+                kwargs['comparefunc'] = comparefunc
+        filtered = (
+            min_total is not None or min_max is not None or where is not None)
+        if filtered:
+            if (
+                lazy or reduce is not None or kwargs.get('group_by_tag')
+                or isinstance(kwargs.get('function'), (list, tuple))
+            ):
+                raise ArgumentError(
+                    "min_total, min_max and where are not supported with "
+                    "lazy, reduce, group_by_tag or multiple functions")
+            kwargs['min_total'] = min_total
+            kwargs['min_max'] = min_max
+            kwargs['where'] = where
+        if reduce is not None and reduce != 'meanvar':
+            raise ArgumentError(
+                "reduce must be None or 'meanvar', got %r" % reduce)
+        if subset_by is not None and reduce is None:
+            raise ArgumentError("subset_by requires reduce='meanvar'")
+        if lazy or reduce is not None:
+            bins = kwargs.get('bins')
+            if (
+                bins is None or ragged or kwargs.get('split_strands', False)
+                or kwargs.get('group_by_tag')
+                or isinstance(kwargs.get('function'), (list, tuple))
+            ):
+                raise ArgumentError(
+                    "lazy=True and reduce require bins, and do not support "
+                    "ragged, split_strands, group_by_tag or multiple "
+                    "functions")
+            if isinstance(bins, int):
+                ncols = bins
+            else:
+                ncols = sum(bins)
+            lazy_array = LazyArray.from_signal(
+                self, features, ncols, processes=processes, **kwargs)
+            if reduce is not None:
+                return lazy_array.metagene(subset_by=subset_by)
+            return lazy_array
         if processes is not None:
             arrays = _array_parallel(
                 self.fn, self.__class__, features, processes=processes,
                 chunksize=chunksize, **kwargs)
         else:
             arrays = _array(self.fn, self.__class__, features, **kwargs)
+        if filtered:
+            if processes is not None:
+                # each chunk's indices are relative to the start of the chunk
+                indices = np.concatenate(
+                    [i * chunksize + chunk_indices
+                     for i, (chunk_indices, _) in enumerate(arrays)]
+                    + [np.zeros(0, dtype=int)])
+                arrays = list(itertools.chain.from_iterable(
+                    rows for _, rows in arrays))
+            else:
+                indices, arrays = arrays
+            return indices, self._stack_filtered(arrays, ragged, **kwargs)
+        function = kwargs.get('function')
+        multiple = isinstance(function, (list, tuple))
+        if (
+            kwargs.get('split_strands', False) or multiple
+            or kwargs.get('group_by_tag')
+        ):
+            # Each row is itself a 2-D array (one row per strand, statistic
+            # or group), so stack these into a 3-D array instead.
+            if processes is not None:
+                arrays = list(itertools.chain.from_iterable(arrays))
+            if ragged:
+                return arrays
+            stacked_arrays = np.empty(
+                (len(arrays[0]), len(arrays)) + arrays[0].shape[1:],
+                dtype=float)
+            for i, a in enumerate(arrays):
+                stacked_arrays[:, i] = a
+            del arrays
+            if multiple:
+                return dict(zip(function, stacked_arrays))
+            return stacked_arrays
         if not ragged:
             stacked_arrays = np.row_stack(arrays)
             del arrays
@@ -129,6 +415,73 @@ class BaseSignal(object):
         else:
             return arrays
 
+    def _stack_filtered(self, arrays, ragged, bins=None,
+                        split_strands=False, **kwargs):
+        """
+        Stacks the rows kept by the row predicates of :meth:`array`,
+        including when there are none.
+        """
+        if ragged:
+            return arrays
+        if isinstance(bins, int):
+            ncols = bins
+        elif bins is not None:
+            ncols = sum(bins)
+        elif len(arrays):
+            ncols = np.shape(arrays[0])[-1]
+        else:
+            ncols = 0
+        if split_strands:
+            stacked_arrays = np.empty((2, len(arrays), ncols), dtype=float)
+            for i, a in enumerate(arrays):
+                stacked_arrays[:, i] = a
+            return stacked_arrays
+        if len(arrays) == 0:
+            return np.zeros((0, ncols))
+        return np.row_stack(arrays)
+
+    def top_features(self, features, k, score='sum', processes=None,
+                     **kwargs):
+        """
+        Finds the `k` features with the highest signal without creating the
+        full array.
+
+        Parameters
+        ----------
+        features : iterable of interval-like objects
+
+        k : int
+            Number of features to return
+
+        score : "sum", "max", "tip" or function
+            How features are ranked; see
+            :meth:`metaseq.lazyarray.LazyArray.top`.  "tip" ranks features
+            the same way as :func:`metaseq.plotutils.tip_zscores`.
+
+        processes : int or None
+            Number of processes used to create the chunks of the array
+
+        Returns
+        -------
+        indices : array
+            Positions in `features` of the selected features, in order of
+            decreasing score
+
+        rows : array
+            The rows of the array for the selected features, with shape
+            (len(indices), bins)
+
+        Notes
+        -----
+        Additional keyword args are passed to :meth:`array` along with
+        ``lazy=True``, so `bins` is required.  Each chunk of features is
+        reduced to its own top `k` rows as it is created (by the workers, if
+        using `processes`).
+        """
+        lazy_array = self.array(
+            features, processes=processes, lazy=True, **kwargs)
+        return lazy_array.top(k, score=score)
+
     def local_coverage(self, features, *args, **kwargs):
         processes = kwargs.pop('processes', None)
         if not processes:
@@ -139,6 +492,11 @@ class BaseSignal(object):
                 "only single features are supported for parallel "
                 "local_coverage")
 
+        if kwargs.get('split_strands', False) or kwargs.get('group_by_tag'):
+            raise ArgumentError(
+                "split_strands and group_by_tag are not supported for "
+                "parallel local_coverage")
+
         # we don't want to have self.array do the binning
         bins = kwargs.pop('bins', None)
 
@@ -183,23 +541,89 @@ class IntervalSignal(BaseSignal):
     local_count.__doc__ = _local_count.__doc__
 
     def count_array(self, features, processes=None, chunksize=1,  **kwargs):
+        """
+        Array of the number of features (or reads) found within each of
+        `features`, as computed by `local_count`.
+
+        If `group_by_tag` is given (BAM only), then a 2-D array of shape
+        (len(groups), len(features)) is returned, from a single pass over
+        each region.
+        """
         if processes is not None:
             arrays = _count_array_parallel(
                 self.fn, self.__class__, features, processes=processes,
                 chunksize=chunksize, **kwargs)
+            arrays = list(itertools.chain.from_iterable(arrays))
         else:
             arrays = _count_array(self.fn, self.__class__, features, **kwargs)
-        return np.concatenate(arrays)
+        counts = np.array(arrays)
+        if kwargs.get('group_by_tag'):
+            return counts.reshape(-1, len(kwargs['groups'])).T
+        return counts
 
 
 class BamSignal(IntervalSignal):
-    def __init__(self, fn):
+    def __init__(self, fn, min_mapq=0, require_flags=0, exclude_flags=0):
         """
         Class for operating on BAM files.
+
+        `min_mapq`, `require_flags` and `exclude_flags` are read filters used
+        by default for all methods of this object; see
+        :func:`metaseq.array_helpers._local_coverage`.  For example,
+        exclude_flags=0x500 skips duplicates and secondary alignments.
         """
         BaseSignal.__init__(self, fn)
         self._readcount = None
-        self.adapter = filetype_adapters.BamAdapter(self.fn)
+        self.read_filters = dict(
+            min_mapq=min_mapq,
+            require_flags=require_flags,
+            exclude_flags=exclude_flags)
+        self.adapter = filetype_adapters.BamAdapter(
+            self.fn, **self.read_filters)
+
+    def _with_read_filters(self, kwargs):
+        """
+        Adds this object's read filters to `kwargs` unless they were
+        specified, so they are used when the file is re-opened (e.g., by
+        other processes).
+
+        Also converts `target_reads` into the `subsample` fraction of
+        mapped reads that gives about that many reads.
+        """
+        for key, value in self.read_filters.items():
+            if value and kwargs.get(key) is None:
+                kwargs[key] = value
+        target_reads = kwargs.pop('target_reads', None)
+        if target_reads is not None:
+            if kwargs.get('subsample') is not None:
+                raise ArgumentError(
+                    "subsample and target_reads cannot both be used")
+            mapped = self.mapped_read_count()
+            if target_reads < mapped:
+                kwargs['subsample'] = target_reads / float(mapped)
+        return kwargs
+
+    def local_coverage(self, features, *args, **kwargs):
+        return IntervalSignal.local_coverage(
+            self, features, *args, **self._with_read_filters(kwargs))
+
+    local_coverage.__doc__ = IntervalSignal.local_coverage.__doc__
+
+    def array(self, features, *args, **kwargs):
+        return IntervalSignal.array(
+            self, features, *args, **self._with_read_filters(kwargs))
+
+    array.__doc__ = IntervalSignal.array.__doc__
+
+    def local_count(self, *args, **kwargs):
+        return IntervalSignal.local_count(
+            self, *args, **self._with_read_filters(kwargs))
+
+    local_count.__doc__ = IntervalSignal.local_count.__doc__
+
+    def count_array(self, features, *args, **kwargs):
+        return IntervalSignal.count_array(
+            self, features, *args, **self._with_read_filters(kwargs))
 
     def genome(self):
         """
@@ -212,57 +636,110 @@ class BamSignal(IntervalSignal):
             d[ref] = (0, length)
         return d
 
-    def mapped_read_count(self, force=False):
+    def mapped_read_count(self, force=False, min_mapq=None,
+                          require_flags=None, exclude_flags=None, exact=False,
+                          processes=None):
         """
-        Counts total reads in a BAM file.
+        Counts total mapped reads in a BAM file.
 
-        If a file self.bam + '.scale' exists, then just read the first line of
-        that file that doesn't start with a "#".  If such a file doesn't exist,
-        then it will be created with the number of reads as the first and only
-        line in the file.
+        By default the count is taken from the statistics in the BAM index,
+        which counts the same reads as `samtools view -c -F 0x4` without
+        reading the file.  If `min_mapq`, `require_flags` or `exclude_flags`
+        are changed from their defaults, or `exact` is True, then the reads
+        placed on each reference are counted instead, one chromosome per
+        process if `processes` is given.
 
-        The result is also stored in self._readcount so that the time-consuming
-        part only runs once; use force=True to force re-count.
+        Counts are cached in a file self.fn + '.mmr', along with the size and
+        modification time of the BAM and the filters used, so a cached count
+        is only used if the BAM has not changed since it was counted.  The
+        result is also stored in self._readcount; use force=True to force
+        a re-count.
 
         Parameters
         ----------
         force : bool
             If True, then force a re-count; otherwise use cached data if
             available.
+
+        min_mapq : int
+            Only count reads with at least this mapping quality.  Defaults to
+            the `min_mapq` this object was created with.
+
+        require_flags, exclude_flags : int
+            Only count reads with all bits of `require_flags` set and none of
+            the bits of `exclude_flags` set in their SAM flag.  Default to the
+            flags this object was created with, and unmapped reads (0x4) are
+            always excluded by default.
+
+        exact : bool
+            If True, count reads rather than using the index statistics.
+
+        processes : int or None
+            Number of processes to use when counting reads.
         """
+        if min_mapq is None:
+            min_mapq = self.read_filters['min_mapq']
+        if require_flags is None:
+            require_flags = self.read_filters['require_flags']
+        if exclude_flags is None:
+            exclude_flags = self.read_filters['exclude_flags'] | 0x4
+        filtered = (
+            min_mapq != 0 or require_flags != 0 or exclude_flags != 0x4
+            or exact)
+        stat = os.stat(self.fn)
+        key = [str(i) for i in (
+            stat.st_size, int(stat.st_mtime), min_mapq, require_flags,
+            exclude_flags, bool(filtered))]
+        key = '\t'.join(key)
+
         # Already run?
-        if self._readcount and not force:
+        if self._readcount and not force and not filtered:
             return self._readcount
 
-        if os.path.exists(self.fn + '.mmr') and not force:
-            for line in open(self.fn + '.mmr'):
+        mmr = self.fn + '.mmr'
+        cached = {}
+        if os.path.exists(mmr):
+            for line in open(mmr):
                 if line.startswith('#'):
                     continue
-                self._readcount = float(line.strip())
-                return self._readcount
-
-        cmds = ['samtools',
-                'view',
-                '-c',
-                '-F', '0x4',
-                self.fn]
-        p = subprocess.Popen(
-            cmds, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = p.communicate()
-        if stderr:
-            sys.stderr.write('samtools says: %s' % stderr)
-            return None
-        mapped_reads = int(stdout)
-
-        # write to file so the next time you need the lib size you can access
-        # it quickly
-        if not os.path.exists(self.fn + '.mmr'):
-            fout = open(self.fn + '.mmr', 'w')
-            fout.write(str(mapped_reads) + '\n')
+                fields = line.rstrip('\n').rsplit('\t', 1)
+                # Files from older versions have just a count, and can't be
+                # checked against the BAM
+                if len(fields) == 2:
+                    cached[fields[0]] = int(fields[1])
+        if key in cached and not force:
+            mapped_reads = cached[key]
+        else:
+            f = self.adapter.fileobj
+            if not filtered:
+                mapped_reads = f.mapped
+            else:
+                kwargs = dict(min_mapq=min_mapq, require_flags=require_flags,
+                              exclude_flags=exclude_flags)
+                args = [(self.fn, ref, kwargs) for ref in f.references]
+                if processes is not None:
+                    pool = multiprocessing.Pool(processes)
+                    counts = pool.map(_bam_read_count_star, args)
+                    pool.close()
+                    pool.join()
+                else:
+                    counts = [_bam_read_count_star(i) for i in args]
+                mapped_reads = sum(counts)
+
+            # write to file so the next time you need the lib size you can
+            # access it quickly
+            cached[key] = mapped_reads
+            fout = open(mmr, 'w')
+            fout.write(
+                '# size\tmtime\tmin_mapq\trequire_flags\texclude_flags\t'
+                'exact\tcount\n')
+            for k, v in sorted(cached.items()):
+                fout.write('%s\t%s\n' % (k, int(v)))
             fout.close()
 
-        self._readcount = mapped_reads
-        return self._readcount
+        if not filtered:
+            self._readcount = mapped_reads
+        return mapped_reads
 
 
 class BigBedSignal(IntervalSignal):
@@ -283,6 +760,70 @@ class BedSignal(IntervalSignal):
         self.adapter = filetype_adapters.BedAdapter(fn)
 
 
+class MergedSignal(IntervalSignal):
+    def __init__(self, signals, scale_factors=None):
+        """
+        Class for treating several BAM, BED or bigBed files of the same kind
+        (e.g., replicates) as a single signal.
+
+        Reads (or features) from all of the files are merged region by
+        region as they are read, so `local_coverage`, `array` and the other
+        methods give the same results as they would for a single merged file
+        without merging the files on disk or creating an array per file.
+
+        Parameters
+        ----------
+        signals : list
+            Genomic signal objects of the same class, e.g., BamSignal
+            objects as created by :func:`genomic_signal`.  Read filters
+            that BamSignal objects were created with are kept.
+
+        scale_factors : None or list
+            If not None, one number per signal.  Each read from a signal
+            then counts as that much, e.g., to normalize replicates to the
+            same depth, or use 1 / len(signals) for each to average them.
+        """
+        specs = []
+        for signal in signals:
+            if isinstance(signal, BaseSignal):
+                if not isinstance(signal, IntervalSignal) or \
+                        isinstance(signal, MergedSignal):
+                    raise ValueError(
+                        "Only BAM, BED and bigBed signals can be merged")
+                # (filename, class, constructor kwargs, scale factor); this
+                # is also the form `signals` takes when a MergedSignal is
+                # re-created from its `fn` in another process.
+                signal = (signal.fn, signal.__class__,
+                          getattr(signal, 'read_filters', {}), 1.)
+            specs.append(tuple(signal))
+        if scale_factors is not None:
+            if len(scale_factors) != len(specs):
+                raise ArgumentError(
+                    "scale_factors must have same length as signals")
+            specs = [spec[:3] + (float(scale),)
+                     for spec, scale in zip(specs, scale_factors)]
+        IntervalSignal.__init__(self, tuple(specs))
+        self.signals = [cls(fn, **kwargs) for fn, cls, kwargs, scale in specs]
+        self.adapter = filetype_adapters.MergedAdapter(
+            [signal.adapter for signal in self.signals],
+            scale_factors=[spec[3] for spec in specs])
+
+    def mapped_read_count(self, **kwargs):
+        """
+        Sum of the mapped read counts of the merged BAM signals, each
+        multiplied by its scale factor.  Keyword args are passed to the
+        `mapped_read_count` method of each signal.
+        """
+        if not all(isinstance(i, BamSignal) for i in self.signals):
+            raise ArgumentError(
+                "mapped_read_count is only available for merged BAM "
+                "signals")
+        return sum(
+            scale * signal.mapped_read_count(**kwargs)
+            for signal, scale in zip(self.signals,
+                                     self.adapter.scale_factors))
+
+
 _registry = {
     'bam': BamSignal,
     'bed': BedSignal,
@@ -14,7 +14,86 @@ class ArgumentError(Exception):
     pass
 
 
-def _local_count(reader, feature, stranded=False):
+# Binning methods that operate on the full-resolution profile, even for bigWig
+# files.
+_full_resolution_methods = ('exact', 'mean_offset_coverage', 'bin_covered')
+
+
+def _is_adapter(reader, classes):
+    """
+    isinstance() for adapters that also looks through
+    a :class:`metaseq.filetype_adapters.MergedAdapter` at the type of the
+    adapters it merges.
+    """
+    if isinstance(reader, filetype_adapters.MergedAdapter):
+        return issubclass(reader.adapter_class, classes)
+    return isinstance(reader, classes)
+
+
+def _read_filters(reader, min_mapq=None, require_flags=None,
+                  exclude_flags=None):
+    """
+    Returns a dictionary of the read filters that were specified, to be
+    passed to :meth:`metaseq.filetype_adapters.BamAdapter.fetch_arrays`.
+    Raises an ArgumentError if filters are given for a file that is not
+    a BAM.
+    """
+    filters = dict(
+        (k, v) for k, v in (
+            ('min_mapq', min_mapq),
+            ('require_flags', require_flags),
+            ('exclude_flags', exclude_flags))
+        if v is not None)
+    if filters and not _is_adapter(reader, filetype_adapters.BamAdapter):
+        raise ArgumentError(
+            "Arguments 'min_mapq', 'require_flags' and 'exclude_flags' only "
+            "supported for BAM")
+    return filters
+
+
+def _check_subsample(reader, subsample):
+    """
+    Raise an ArgumentError if reads can't be subsampled from `reader` by the
+    fraction `subsample`.
+    """
+    if not _is_adapter(reader, (filetype_adapters.BamAdapter,
+                                filetype_adapters.BedAdapter)):
+        raise ArgumentError(
+            "Argument 'subsample' only supported for BAM and BED")
+    if not 0 < subsample <= 1:
+        raise ArgumentError(
+            "subsample must be greater than 0 and at most 1, got %s"
+            % subsample)
+
+
+def _group_indices(reader, group_by_tag, groups):
+    """
+    Checks the `group_by_tag` and `groups` arguments, returning a dictionary
+    of tag value -> index into `groups`.
+    """
+    if not isinstance(reader, filetype_adapters.BamAdapter):
+        raise ArgumentError(
+            "Argument 'group_by_tag' only supported for BAM")
+    if groups is None:
+        raise ArgumentError(
+            "groups, the list of tag values to use, is required with "
+            "group_by_tag")
+    return dict((group, i) for i, group in enumerate(groups))
+
+
+def _split_groups(records, tags, lookup):
+    """
+    Returns the index of each record's group, and the records and indices
+    for only those records whose tag is one of the groups in `lookup`.
+    """
+    inds = np.array([lookup.get(tag, -1) for tag in tags], dtype=int)
+    keep = inds >= 0
+    return records[keep], inds[keep]
+
+
+def _local_count(reader, feature, stranded=False, min_mapq=None,
+                 require_flags=None, exclude_flags=None, group_by_tag=None,
+                 groups=None, subsample=None):
     """
     The count of genomic signal (typcially BED features) found within an
     interval.
@@ -24,7 +103,21 @@ def _local_count(reader, feature, stranded=False):
     :param feature: pybedtools.Interval object
     :param stranded: If `stranded=True`, then only counts signal on the same
         strand as `feature`.
+    :param min_mapq, require_flags, exclude_flags: BAM read filters; see
+        :func:`_local_coverage`.
+    :param group_by_tag, groups: If `group_by_tag` is given, return an array
+        of counts, one for each tag value in `groups`; see
+        :func:`_local_coverage`.
+    :param subsample: Count a deterministic subset of about this fraction of
+        reads, scaled up by 1 / `subsample`; see :func:`_local_coverage`.
     """
+    filters = _read_filters(reader, min_mapq, require_flags, exclude_flags)
+    if subsample is not None:
+        _check_subsample(reader, subsample)
+        filters['subsample'] = subsample
+        scale = 1. / subsample
+    else:
+        scale = 1
     if isinstance(feature, basestring):
         feature = helpers.tointerval(feature)
     if stranded:
@@ -32,18 +125,134 @@ def _local_count(reader, feature, stranded=False):
     else:
         strand = '.'
 
-    count = 0
-    for al in reader[feature]:
-        if stranded and al.strand != strand:
-            continue
-        count += 1
-    return count
+    if group_by_tag:
+        lookup = _group_indices(reader, group_by_tag, groups)
+        records, tags = reader.fetch_arrays(
+            feature, group_by_tag=group_by_tag, **filters)
+        records, inds = _split_groups(records, tags, lookup)
+        if stranded:
+            inds = inds[records['strand'] == strand]
+        return np.bincount(inds, minlength=len(groups)) * scale
+
+    if isinstance(reader, filetype_adapters.MergedAdapter):
+        records, weights = reader.fetch_arrays(
+            feature, weights=True, **filters)
+        if stranded:
+            weights = weights[records['strand'] == strand]
+        return weights.sum() * scale
+
+    records = reader.fetch_arrays(feature, **filters)
+    if stranded:
+        return int((records['strand'] == strand).sum()) * scale
+    return len(records) * scale
+
+
+def _add_coverage(target, start_inds, stop_inds, scores, accumulate=True,
+                  preserve_total=False):
+    """
+    Adds the coverage of intervals [start_inds, stop_inds) with values
+    `scores` to the 1-D array `target`, in place.  Indices must already be
+    clipped to the array; empty intervals are ignored.
+
+    If `accumulate` is True, scores are summed (and divided by the length of
+    each interval if `preserve_total` is True); otherwise each position is
+    set to the score of the last interval covering it.
+    """
+    n = len(target)
+    nonempty = stop_inds > start_inds
+    start_inds = start_inds[nonempty]
+    stop_inds = stop_inds[nonempty]
+    scores = scores[nonempty]
+
+    # Number of intervals covering each position, via the running sum of
+    # +1 at each start and -1 at each stop.
+    counts = np.cumsum(
+        np.bincount(start_inds, minlength=n + 1)
+        - np.bincount(stop_inds, minlength=n + 1))[:n]
+    covered = counts > 0
+
+    if accumulate:
+        if preserve_total:
+            scores = scores / (stop_inds - start_inds).astype(float)
+        values = np.cumsum(
+            np.bincount(start_inds, weights=scores, minlength=n + 1)
+            - np.bincount(stop_inds, weights=scores, minlength=n + 1))[:n]
+        # Floating-point rounding in the running sum can leave tiny nonzero
+        # values where nothing is covered.
+        target[covered] += values[covered]
+    elif np.all(scores == 1):
+        target[covered] = 1
+    else:
+        # Later intervals overwrite earlier ones, so keep the order
+        for i, j, score in itertools.izip(start_inds, stop_inds, scores):
+            target[i:j] = score
+
+
+def _add_cutsites(target, inds, scores, accumulate=True):
+    """
+    Adds `scores` at the positions `inds` of the 1-D array `target`, in
+    place; positions outside the array are ignored.
+
+    If `accumulate` is False, each position is instead set to the score of
+    the last cut site at that position.
+    """
+    n = len(target)
+    inside = (inds >= 0) & (inds < n)
+    inds = inds[inside]
+    scores = scores[inside]
+    if accumulate:
+        target += np.bincount(inds, weights=scores, minlength=n)
+    else:
+        target[inds] = scores
+
+
+def _check_bigwig_kwargs(read_strand=None, fragment_size=None, shift_width=0,
+                         use_score=False, preserve_total=False,
+                         split_strands=False, paired_fragments=False,
+                         junctions=False, group_by_tag=None, mode='coverage',
+                         min_mapq=None, require_flags=None, exclude_flags=None,
+                         subsample=None, **kwargs):
+    """
+    Raise an ArgumentError if an argument that is not supported for bigWig
+    files has been changed from its default.
+    """
+    if subsample is not None:
+        raise ArgumentError(
+            "Argument 'subsample' only supported for BAM and BED")
+    defaults = (
+        ('read_strand', read_strand, None),
+        ('fragment_size', fragment_size, None),
+        ('shift_width', shift_width, 0),
+        ('use_score', use_score, False),
+        ('preserve_total', preserve_total, False),
+        ('split_strands', split_strands, False),
+        ('paired_fragments', paired_fragments, False),
+        ('junctions', junctions, False),
+        ('group_by_tag', group_by_tag, None),
+        ('mode', mode, 'coverage'),
+        ('min_mapq', min_mapq, None),
+        ('require_flags', require_flags, None),
+        ('exclude_flags', exclude_flags, None),
+    )
+    for name, check, default in defaults:
+        if (
+            ((default is None) and (check is not default))
+            or
+            (check != default)
+        ):
+            raise ArgumentError(
+                "Argument '%s' not supported for bigWig" % name)
 
 
 def _local_coverage(reader, features, read_strand=None, fragment_size=None,
                     shift_width=0, bins=None, use_score=False, accumulate=True,
                     preserve_total=False, method=None, processes=None,
-                    stranded=True, verbose=False):
+                    stranded=True, verbose=False, split_strands=False,
+                    function='mean', zoom=None, max_error=None,
+                    min_mapq=None, require_flags=None, exclude_flags=None,
+                    paired_fragments=False, max_fragment_size=1000,
+                    junctions=False, group_by_tag=None, groups=None,
+                    mode='coverage', cut_offsets=(4, -5), subsample=None):
     """
     Returns a binned vector of coverage.
 
@@ -140,7 +349,7 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
 
     method : str;
         all types:
-            * one of ["mean_bin_coverage", "bin_covered", None]
+            * one of ["exact", "mean_offset_coverage", "bin_covered", None]
         bigWig specific:
             * one of [ "summarize" | "get_as_array" | "ucsc_summarize" ]
 
@@ -163,6 +372,16 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
         UCSC program `bigWigSummary`, which must already installed and on your
         path.
 
+        "exact": each bin is the exact mean of the un-binned signal over
+        the bin, computed from a cumulative sum. Bin edges may fall between
+        positions, in which case a position contributes to each bin in
+        proportion to its overlap.  Bins are symmetric, so binning a minus
+        strand feature gives the reversed bins of the plus strand.  If
+        `preserve_total` is True, each bin is the exact sum instead so no
+        re-scaling is needed.  Faster than the default interpolation for
+        large features.  For bigWig files, data are extracted as with
+        "get_as_array" and then binned.
+
         "mean_offset_coverage": Let's split [start, stop] range in nbin bins,
         where each bin represents average peaks coverage (per bp) around
         the bin center. 'xs' array contains bin centers. If 'accumulate'
@@ -197,10 +416,108 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
     processes : int or None
         The feature can be split across multiple processes.
 
+    split_strands : bool
+        If True, then compute the coverage of plus-strand and minus-strand
+        items from a single pass over the genomic signal.  The returned `y`
+        will then be a 2-row array, where the first row is equivalent to
+        using read_strand="+" and the second to using read_strand="-".
+        Cannot be combined with `read_strand`.  Not available for bigWig.
+
+    function : str or list
+        The statistic to report for each bin of a bigWig file, one of "mean"
+        (default), "sum", "min", "max", "std", or "coverage".  If a list of
+        these is provided, all statistics are computed from a single query of
+        the file, and the returned `y` will have one row per statistic.  Only
+        available for bigWig, and not for method="get_as_array".
+
+    zoom, max_error : int, float
+        Summarize bigWig files from the coarsest zoom level with a resolution
+        of at most `zoom` bp, or at most `max_error` times the bin size (e.g.,
+        0.1 for 1-kb resolution in 10-kb bins), rather than letting bx-python
+        choose the zoom level.  Faster at the cost of precision for large
+        bins.  See
+        :meth:`metaseq.filetype_adapters.BigWigAdapter.zoom_level` to find
+        the level that will be used.  Only available for bigWig with
+        method="summarize".
+
+    min_mapq : int
+        Skip reads with a mapping quality less than this.  Only available for
+        BAM.
+
+    require_flags, exclude_flags : int
+        Skip reads that do not have all of the bits in `require_flags` set,
+        or that have any of the bits in `exclude_flags` set, in their SAM
+        flag; e.g., exclude_flags=0x400 skips duplicates and
+        exclude_flags=0x100 skips secondary alignments.  Only available for
+        BAM.
+
+    paired_fragments : bool
+        If True, then use the fragments of a paired-end library instead of
+        reads.  Each fragment is built once from the template length of its
+        properly-paired first mate, and has the strand of the first mate.
+        Cannot be combined with `fragment_size`.  Only available for BAM.
+
+    max_fragment_size : int
+        When using `paired_fragments`, skip fragments longer than this.  The
+        window is padded by this much when fetching reads so that fragments
+        overlapping the window edges are found.
+
+    junctions : bool
+        If True, then also count the splice junctions ("N" CIGAR operations)
+        of the reads in the same pass over the BAM file used for coverage,
+        and return them as a third item.  Only available for BAM, and
+        cannot be combined with `paired_fragments`.
+
+    group_by_tag : str
+        Name of a SAM tag, e.g., "CB" for cell barcodes or "RG" for read
+        groups.  If given, then the reads are split by the value of this tag
+        as they are read, and the coverage of each group is computed from the
+        same pass over the BAM file.  Requires `groups`, and cannot be
+        combined with `split_strands` or `junctions`.  Only available for
+        BAM.
+
+    groups : list
+        When using `group_by_tag`, the tag values to report, in order.  Each
+        is a row of the returned 2-d array; reads whose tag is missing or not
+        in `groups` are skipped.
+
+    mode : "coverage" or "cutsites"
+        If "coverage" (default), then the signal at each position is the
+        number of reads (or fragments) covering it.  If "cutsites", then each
+        read is reduced to a single position, its 5' end shifted by
+        `cut_offsets`, and the signal is the number of these cut sites at
+        each position; e.g., for the Tn5 insertion sites of ATAC-seq or the
+        cleavage sites of CUT&RUN.  "cutsites" cannot be combined with
+        `fragment_size`, `shift_width` or `paired_fragments`.  Not available
+        for bigWig.
+
+    cut_offsets : tuple
+        When using mode="cutsites", the (plus-strand, minus-strand) offsets
+        in bp added to the 5' end of each read.  The default of (4, -5) is
+        the usual Tn5 correction for ATAC-seq; use (0, 0) for the 5' ends
+        themselves.
+
+    subsample : None or float
+        If not None, then use a deterministic subset of about this fraction
+        of the reads (e.g., 0.1) for a quick preview.  Reads are chosen by
+        hashing their names (or, for BED, their lines), so the same reads
+        are used across windows, processes and runs, and the signal is
+        scaled by 1 / `subsample` to be comparable to using all reads.  For
+        BAM signals, `target_reads` can be given instead to use about that
+        many of the mapped reads.  Only available for BAM and BED.
+
     Returns
     -------
 
-    1-d NumPy array
+    1-d NumPy array (or 2-d, if `split_strands` is True, `function` is
+    a list or `group_by_tag` is given)
+
+    If `junctions` is True, then a structured array with
+    :data:`metaseq.filetype_adapters.junction_dtype` (fields "donor",
+    "acceptor", "strand" and "count") is returned as well, with one row per
+    distinct junction whose intron overlaps each window.  Rows from
+    different windows are not merged.  The strand of a junction comes from
+    the XS tag if present; `read_strand` is not applied to junctions.
 
 
     Notes
@@ -223,31 +540,85 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
     # with one; raise exeception if a kwarg was supplied that's not supported.
     if isinstance(reader, filetype_adapters.BigWigAdapter):
         is_bigwig = True
-        defaults = (
-            ('read_strand', read_strand, None),
-            ('fragment_size', fragment_size, None),
-            ('shift_width', shift_width, 0),
-            ('use_score', use_score, False),
-            ('preserve_total', preserve_total, False),
-        )
-        for name, check, default in defaults:
-            if (
-                ((default is None) and (check is not default))
-                or
-                (check != default)
-            ):
-                raise ArgumentError(
-                    "Argument '%s' not supported for bigWig" % name)
+        _check_bigwig_kwargs(
+            read_strand=read_strand, fragment_size=fragment_size,
+            shift_width=shift_width, use_score=use_score,
+            preserve_total=preserve_total, split_strands=split_strands,
+            paired_fragments=paired_fragments, junctions=junctions,
+            group_by_tag=group_by_tag, mode=mode)
 
         if method == 'ucsc_summarize':
             if preserve_total:
                 raise ArgumentError(
                     "preserve_total=True not supported when using "
                     "method='ucsc_summarize'")
+        if (
+            (zoom is not None or max_error is not None)
+            and method not in (None, 'summarize')
+        ):
+            raise ArgumentError(
+                "zoom and max_error are only supported for the default "
+                "method")
     else:
         is_bigwig = False
+        if function != 'mean':
+            raise ArgumentError(
+                "Argument 'function' only supported for bigWig")
+        if zoom is not None or max_error is not None:
+            raise ArgumentError(
+                "Arguments 'zoom' and 'max_error' only supported for bigWig")
+
+    filters = _read_filters(reader, min_mapq, require_flags, exclude_flags)
+    if subsample is not None:
+        _check_subsample(reader, subsample)
+        filters['subsample'] = subsample
+    if paired_fragments:
+        if not _is_adapter(reader, filetype_adapters.BamAdapter):
+            raise ArgumentError(
+                "Argument 'paired_fragments' only supported for BAM")
+        if fragment_size:
+            raise ArgumentError(
+                "fragment_size cannot be used with paired_fragments=True")
+        filters['paired_fragments'] = True
+        filters['max_fragment_size'] = max_fragment_size
+
+    if junctions:
+        if not isinstance(reader, filetype_adapters.BamAdapter):
+            raise ArgumentError(
+                "Argument 'junctions' only supported for BAM")
+        if paired_fragments:
+            raise ArgumentError(
+                "junctions cannot be used with paired_fragments=True")
+
+    if mode == 'cutsites':
+        if fragment_size or shift_width or paired_fragments:
+            raise ArgumentError(
+                "fragment_size, shift_width and paired_fragments cannot be "
+                "used with mode='cutsites'; use cut_offsets instead")
+        if _is_adapter(reader, filetype_adapters.BamAdapter):
+            filters['whole_reads'] = True
+    elif mode != 'coverage':
+        raise ArgumentError(
+            "mode must be 'coverage' or 'cutsites', got %r" % (mode,))
+
+    if group_by_tag:
+        lookup = _group_indices(reader, group_by_tag, groups)
+        if split_strands:
+            raise ArgumentError(
+                "group_by_tag cannot be used with split_strands=True")
+        if junctions:
+            raise ArgumentError(
+                "group_by_tag cannot be used with junctions=True")
+
+    if split_strands and read_strand:
+        raise ArgumentError(
+            "read_strand cannot be used with split_strands=True")
 
-    if isinstance(reader, filetype_adapters.BamAdapter):
+    # Features from the files of a MergedAdapter are weighted by their scale
+    # factors
+    merged = isinstance(reader, filetype_adapters.MergedAdapter)
+
+    if _is_adapter(reader, filetype_adapters.BamAdapter):
         if use_score:
             raise ArgumentError("Argument 'use_score' not supported for "
                                 "bam")
@@ -276,6 +647,7 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
     #
     profiles = []
     xs = []
+    junction_tables = []
     for window, nbin in zip(features, bins):
         window = helpers.tointerval(window)
         chrom = window.chrom
@@ -286,7 +658,12 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
         if not is_bigwig:
             # Extend the window to catch reads that would extend into the
             # requested window
-            _fs = fragment_size or 0
+            if paired_fragments:
+                _fs = max_fragment_size
+            elif mode == 'cutsites':
+                _fs = max(abs(offset) for offset in cut_offsets)
+            else:
+                _fs = fragment_size or 0
             padded_window = pybedtools.Interval(
                 chrom,
                 max(start - _fs - shift_width, 0),
@@ -294,67 +671,113 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
             )
             window_size = stop - start
 
-            # start off with an array of zeros to represent the window
-            profile = np.zeros(window_size, dtype=float)
-
-            for interval in reader[padded_window]:
-
-                if read_strand:
-                    if interval.strand != read_strand:
-                        continue
-
-                # Shift interval by modeled distance, if specified.
-                if shift_width:
-                    if interval.strand == '-':
-                        interval.start -= shift_width
-                        interval.stop -= shift_width
-                    else:
-                        interval.start += shift_width
-                        interval.stop += shift_width
-
-                # Extend fragment size from 3'
-                if fragment_size:
-                    if interval.strand == '-':
-                        interval.start = interval.stop - fragment_size
-                    else:
-                        interval.stop = interval.start + fragment_size
-
+            # start off with an array of zeros to represent the window (or
+            # two, one for each strand, or one for each group)
+            if split_strands:
+                profile = np.zeros((2, window_size), dtype=float)
+            elif group_by_tag:
+                profile = np.zeros((len(groups), window_size), dtype=float)
+            else:
+                profile = np.zeros(window_size, dtype=float)
+
+            if junctions:
+                records, table = reader.fetch_arrays(
+                    padded_window, junctions=True, **filters)
+                junction_tables.append(
+                    table[(table['donor'] < stop)
+                          & (table['acceptor'] > start)])
+            elif group_by_tag:
+                records, tags = reader.fetch_arrays(
+                    padded_window, group_by_tag=group_by_tag, **filters)
+                records, group_inds = _split_groups(records, tags, lookup)
+            elif merged:
+                records, weights = reader.fetch_arrays(
+                    padded_window, weights=True, **filters)
+            else:
+                records = reader.fetch_arrays(padded_window, **filters)
+            if read_strand:
+                selected = records['strand'] == read_strand
+                records = records[selected]
+                if group_by_tag:
+                    group_inds = group_inds[selected]
+                if merged:
+                    weights = weights[selected]
+            minus = records['strand'] == '-'
+            starts = records['start']
+            stops = records['stop']
+
+            # Shift intervals by modeled distance, if specified.
+            if shift_width:
+                shift = np.where(minus, -shift_width, shift_width)
+                starts = starts + shift
+                stops = stops + shift
+
+            # Extend fragment size from 3'
+            if fragment_size:
+                starts, stops = (
+                    np.where(minus, stops - fragment_size, starts),
+                    np.where(minus, stops, starts + fragment_size))
+
+            if mode == 'cutsites':
+                # Reduce each read to its shifted 5' end, as an index into
+                # the array
+                plus_offset, minus_offset = cut_offsets
+                sites = np.where(
+                    minus, stops - 1 + minus_offset, starts + plus_offset)
+                sites -= start
+            else:
                 # Convert to 0-based coords that can be used as indices into
-                # array
-                start_ind = interval.start - start
-
-                # If the feature goes out of the window, then only include the
-                # part that's inside the window
-                start_ind = max(start_ind, 0)
-
-                # Same thing for stop
-                stop_ind = interval.stop - start
-                stop_ind = min(stop_ind, window_size)
-
-                # Skip if the feature is shifted outside the window. This can
-                # happen with large values of `shift_width`.
-                if start_ind >= window_size or stop_ind < 0:
-                    continue
+                # array, only including the part of each interval that's
+                # inside the window
+                start_inds = np.maximum(starts - start, 0)
+                stop_inds = np.minimum(stops - start, window_size)
+
+            if use_score:
+                scores = records['score']
+                if np.isnan(scores).any():
+                    raise ValueError(
+                        "use_score=True but not all scores in %s are "
+                        "numbers" % padded_window)
+            else:
+                scores = np.ones(len(records))
+            if merged:
+                scores = scores * weights
+
+            if split_strands:
+                targets = [
+                    (profile[0], records['strand'] == '+'),
+                    (profile[1], minus)]
+            elif group_by_tag:
+                # only the groups with reads in this window
+                targets = [
+                    (profile[i], group_inds == i)
+                    for i in np.unique(group_inds)]
+            else:
+                targets = [(profile, slice(None))]
 
-                # Finally, increment profile
-                if use_score:
-                    score = float(interval.score)
+            for target, selected in targets:
+                if mode == 'cutsites':
+                    _add_cutsites(
+                        target, sites[selected], scores[selected],
+                        accumulate=accumulate)
                 else:
-                    score = 1
+                    _add_coverage(
+                        target, start_inds[selected], stop_inds[selected],
+                        scores[selected], accumulate=accumulate,
+                        preserve_total=preserve_total)
 
-                if accumulate:
-                    if preserve_total:
-                        profile[start_ind:stop_ind] += (
-                            score / float((stop_ind - start_ind)))
-                    else:
-                        profile[start_ind:stop_ind] += score
-
-                else:
-                    profile[start_ind:stop_ind] = score
+            # Scale up a subsample to the full depth
+            if subsample is not None and accumulate:
+                profile /= subsample
 
         else:  # it's a bigWig
+            if method in _full_resolution_methods:
+                _method = 'get_as_array'
+            else:
+                _method = method
             profile = reader.summarize(
-                window, method=method, bins=(nbin or len(window)))
+                window, method=_method, bins=(nbin or len(window)),
+                function=function, zoom=zoom, max_error=max_error)
 
         # If no bins, return genomic coords
         if (nbin is None):
@@ -364,56 +787,37 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
         # coords
         else:
             if preserve_total:
-                total = float(profile.sum())
-
-            if method == 'mean_offset_coverage' or method == 'bin_covered':
-                # Let's split [start, stop] range in nbin bins, where each
-                # bin represent average peaks coverage (per bp) around the bin.
-                # Profile for minus strand is reversed profile for plus strand,
-                # so we need to split in bins symmetrically.
-                # So:
-                # * start offset represents [start, start + bin_size / 2) bind
-                # * stop offset represents [stop - bin_size / 2, stop] bin
-                # * i-th bin center: [center_i - bin_size / 2,
-                #                     center_i + bin_size/2)
+                total = profile.sum(axis=-1, keepdims=True)
 
+            if method == 'exact':
                 size = stop - start
-                assert size == len(profile)
-                assert nbin > 2
-
-                # Let's split in nbins + (nbins - 1) small bins. In this case
-                # we have 1 small bin near start, 1 small near stop and
-                # each 2 inner small bins represent one normal bin.
-
-                # Otherwise we need to be more accurate while calculating
-                # indexes
-                bounds = np.linspace(0, size - 1, nbin * 2 - 1)
-
-                # inner bins bounds indexes
-                ib_bounds = zip(np.ceil(bounds[1:-3:2]).astype(int),
-                                np.ceil(bounds[3:-1:2]).astype(int) - 1)
-
-                ib_centers = np.ceil(bounds[2:-1:2]).astype(int)
-
-                profile = np.fromiter(itertools.chain(
-                    (profile[0: max(1, ib_bounds[0][0])].mean(),),
-                    [profile[l:max(l, r) + 1].mean() for l, r in ib_bounds],
-                    (profile[min(size - 1, ib_bounds[-1][1] + 1):].mean(),)
-                ), float, count=nbin)
+                profile = helpers.bin_sums(profile, nbin)
+                if not preserve_total:
+                    profile /= float(size) / nbin
+                if not accumulate:
+                    nonzero = profile != 0
+                    profile[nonzero] = 1
+                x = helpers.bin_centers(start, stop, nbin)
 
-                x = np.fromiter(itertools.chain(
-                    (start,),
-                    (start + offset for offset in ib_centers),
-                    (stop - 1,)
-                ), int, count=nbin)
+            elif method == 'mean_offset_coverage' or method == 'bin_covered':
+                size = stop - start
+                assert size == profile.shape[-1]
+                assert nbin > 2
+                offsets = _offset_bins(size, nbin)[2]
+                profile = _offset_bin_means(profile, nbin)
+                x = start + offsets
 
                 if method == 'bin_covered':
                     nonzero = profile != 0
                     profile[nonzero] = 1
 
             elif not is_bigwig or method == 'get_as_array':
-                xi, profile = rebin(
-                    x=np.arange(start, stop), y=profile, nbin=nbin)
+                if profile.ndim == 1:
+                    xi, profile = rebin(
+                        x=np.arange(start, stop), y=profile, nbin=nbin)
+                else:
+                    xi = np.linspace(start, stop - 1, nbin)
+                    profile = helpers.rebin_rows(profile, nbin)
                 if not accumulate:
                     nonzero = profile != 0
                     profile[nonzero] = 1
@@ -424,10 +828,10 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
 
         # Minus-strand profiles should be flipped left-to-right.
         if stranded and strand == '-':
-            profile = profile[::-1]
+            profile = profile[..., ::-1]
         xs.append(x)
-        if preserve_total:
-            scale = profile.sum() / total
+        if preserve_total and nbin is not None and method != 'exact':
+            scale = profile.sum(axis=-1, keepdims=True) / total
             profile /= scale
         profiles.append(profile)
 
@@ -435,9 +839,85 @@ def _local_coverage(reader, features, read_strand=None, fragment_size=None,
     stacked_profiles = np.hstack(profiles)
     del xs
     del profiles
+    if junctions:
+        return stacked_xs, stacked_profiles, np.hstack(junction_tables)
     return stacked_xs, stacked_profiles
 
 
+# (window_size, nbin) -> index arrays used by _offset_bin_means.  These only
+# depend on the size of the window, so they are shared by all features of the
+# same length.
+_offset_bins_cache = {}
+
+
+def _offset_bins(size, nbin):
+    """
+    Returns `(indices, counts, offsets)` describing the bins used by the
+    "mean_offset_coverage" and "bin_covered" methods for a window of `size`
+    bp split into `nbin` bins.
+
+    `indices` are the interleaved [start, stop) positions of each bin, ready
+    for np.add.reduceat on a profile padded with one trailing zero; `counts`
+    are the number of positions in each bin; `offsets` are the bin centers
+    relative to the start of the window.  Results are cached per
+    `(size, nbin)`.
+    """
+    key = (size, nbin)
+    try:
+        return _offset_bins_cache[key]
+    except KeyError:
+        pass
+
+    # Let's split [start, stop] range in nbin bins, where each bin represent
+    # average peaks coverage (per bp) around the bin.  Profile for minus
+    # strand is reversed profile for plus strand, so we need to split in bins
+    # symmetrically.
+    # So:
+    # * start offset represents [start, start + bin_size / 2) bin
+    # * stop offset represents [stop - bin_size / 2, stop] bin
+    # * i-th bin center: [center_i - bin_size / 2,
+    #                     center_i + bin_size/2)
+    #
+    # Let's split in nbins + (nbins - 1) small bins. In this case we have
+    # 1 small bin near start, 1 small near stop and each 2 inner small bins
+    # represent one normal bin.
+    bounds = np.linspace(0, size - 1, nbin * 2 - 1)
+
+    # inner bins bounds indexes
+    lefts = np.ceil(bounds[1:-3:2]).astype(int)
+    rights = np.ceil(bounds[3:-1:2]).astype(int) - 1
+
+    starts = np.concatenate(
+        ([0], lefts, [min(size - 1, rights[-1] + 1)]))
+    stops = np.concatenate(
+        ([max(1, lefts[0])], np.maximum(lefts, rights) + 1, [size]))
+
+    indices = np.empty(nbin * 2, dtype=int)
+    indices[0::2] = starts
+    indices[1::2] = stops
+    counts = (stops - starts).astype(float)
+    offsets = np.concatenate(
+        ([0], np.ceil(bounds[2:-1:2]).astype(int), [size - 1]))
+
+    _offset_bins_cache[key] = indices, counts, offsets
+    return indices, counts, offsets
+
+
+def _offset_bin_means(profile, nbin):
+    """
+    Mean of `profile` in each of the bins described by :func:`_offset_bins`,
+    computed with a single np.add.reduceat call.  `profile` can be 1-D or
+    a 2-D array of equal-length rows.
+    """
+    size = profile.shape[-1]
+    indices, counts, offsets = _offset_bins(size, nbin)
+    padded = np.zeros(profile.shape[:-1] + (size + 1,))
+    padded[..., :size] = profile
+    # Every other segment is a bin; the ones in between are discarded
+    sums = np.add.reduceat(padded, indices, axis=-1)[..., ::2]
+    return sums / counts
+
+
 def _array_parallel(fn, cls, genelist, chunksize=250, processes=1, **kwargs):
     """
     Returns an array of genes in `genelist`, using `bins` bins.
@@ -467,6 +947,70 @@ def _array_parallel(fn, cls, genelist, chunksize=250, processes=1, **kwargs):
     pool.join()
     return results
 
+def _multi_array_parallel(specs, genelist, shape, chunksize=250, processes=1,
+                          **kwargs):
+    """
+    Parallel version of :func:`_multi_array`.
+
+    The result is assembled in shared memory: each process fills in the
+    columns for its chunk of `genelist` directly, so only the finished 3-D
+    array -- and no per-chunk copies of it -- is ever created.
+    """
+    shared = multiprocessing.RawArray('d', int(np.prod(shape)))
+    pool = multiprocessing.Pool(
+        processes, initializer=_init_shared_array, initargs=(shared, shape))
+    chunks = list(chunker(genelist, chunksize))
+    offsets = np.cumsum([0] + [len(i) for i in chunks[:-1]])
+    pool.map(
+        func=_multi_array_star,
+        iterable=itertools.izip(
+            itertools.repeat(specs),
+            chunks,
+            offsets,
+            itertools.repeat(kwargs)))
+    pool.close()
+    pool.join()
+    return np.frombuffer(shared).reshape(shape)
+
+
+# The shared array is handed to each worker process once, when the pool is
+# created, rather than being pickled with every chunk.
+_shared_array = None
+
+
+def _init_shared_array(shared, shape):
+    global _shared_array
+    _shared_array = np.frombuffer(shared).reshape(shape)
+
+
+def _multi_array_star(args):
+    """
+    Unpacks the tuple `args` and calls _multi_array on this process's view
+    of the shared array.
+    """
+    specs, genelist, offset, kwargs = args
+    out = _shared_array[:, offset:offset + len(genelist)]
+    _multi_array(specs, genelist, out, **kwargs)
+
+
+def _multi_array(specs, genelist, out, scale_factors=None, **kwargs):
+    """
+    Fills `out`, a (len(specs), len(genelist), bins) array, with the array
+    for `genelist` from each signal in `specs`.
+
+    `specs` is a list of (filename, class, signal_kwargs) tuples, where
+    `signal_kwargs` are added to `kwargs` for that signal only (e.g., the
+    read filters of a BamSignal); each signal is opened once for the whole
+    of `genelist`.  If `scale_factors` is not None, the rows for the i-th
+    signal are multiplied in place by `scale_factors[i]`.
+    """
+    for i, (fn, cls, signal_kwargs) in enumerate(specs):
+        out[i] = _array(fn, cls, genelist, **dict(kwargs, **signal_kwargs))
+        if scale_factors is not None:
+            out[i] *= scale_factors[i]
+    return out
+
+
 def _count_array_parallel(fn, cls, genelist, chunksize=250, processes=1, **kwargs):
     pool = multiprocessing.Pool(processes)
     chunks = list(chunker(genelist, chunksize))
@@ -496,6 +1040,31 @@ def _count_array(fn, cls, genelist, **kwargs):
         biglist.append(c)
     return biglist
 
+def _bam_read_count(fn, chrom, min_mapq=0, require_flags=0,
+                    exclude_flags=0x4):
+    """
+    Counts the reads on `chrom` in BAM file `fn` with mapping quality of at
+    least `min_mapq`, all of the bits in `require_flags` set, and none of the
+    bits in `exclude_flags` set.
+    """
+    count = 0
+    for read in pysam.Samfile(fn, 'rb').fetch(chrom):
+        if read.mapq < min_mapq:
+            continue
+        flag = read.flag
+        if (flag & require_flags) != require_flags:
+            continue
+        if flag & exclude_flags:
+            continue
+        count += 1
+    return count
+
+
+def _bam_read_count_star(args):
+    fn, chrom, kwargs = args
+    return _bam_read_count(fn, chrom, **kwargs)
+
+
 def _array_star(args):
     """
     Unpacks the tuple `args` and calls _array.  Needed to pass multiple args to
@@ -505,12 +1074,124 @@ def _array_star(args):
     return _array(fn, cls, genelist, **kwargs)
 
 
-def _array(fn, cls, genelist, **kwargs):
+# Number of features at a time for which _normalized_array creates the
+# un-normalized rows
+_normalize_chunksize = 1000
+
+
+def _normalized_array(fn, cls, genelist, scale=None, control=None,
+                      comparefunc=np.subtract, transform=None, **kwargs):
+    """
+    Version of :func:`_array` that normalizes each row as it is created.
+
+    If `scale` is not None, each row is multiplied by it.  If `control` is
+    a (filename, class, scale, read_filters) tuple, then rows for that
+    signal are created with the same arguments but its own `read_filters`,
+    multiplied by its own scale (if not None), and combined with the rows of
+    this signal as comparefunc(row, control_row).
+    Finally `transform`, if not None, is applied to each row.
+
+    Features are handled :data:`_normalize_chunksize` at a time, so only the
+    normalized rows are kept for all of `genelist`.
+    """
+    biglist = []
+    for chunk in chunker(genelist, _normalize_chunksize):
+        rows = _array(fn, cls, chunk, **kwargs)
+        if control is not None:
+            control_fn, control_cls, control_scale, control_filters = control
+            control_rows = _array(control_fn, control_cls, chunk,
+                                  **dict(kwargs, **control_filters))
+        for i, row in enumerate(rows):
+            if scale is not None:
+                row = row * scale
+            if control is not None:
+                control_row = control_rows[i]
+                if control_scale is not None:
+                    control_row = control_row * control_scale
+                row = comparefunc(row, control_row)
+            if transform is not None:
+                row = transform(row)
+            biglist.append(row)
+        del rows
+    return biglist
+
+
+def _keep_row(row, min_total=None, min_max=None, where=None):
+    """
+    True if `row` passes all the given row predicates.  For 2-D rows (e.g.,
+    from `split_strands`), `min_total` and `min_max` must be met by each
+    sub-row.
+    """
+    row = np.asarray(row)
+    if min_total is not None and not np.all(row.sum(axis=-1) >= min_total):
+        return False
+    if min_max is not None and (
+            row.shape[-1] == 0 or not np.all(row.max(axis=-1) >= min_max)):
+        return False
+    if where is not None and not where(row):
+        return False
+    return True
+
+
+def _filtered_array(fn, cls, genelist, min_total=None, min_max=None,
+                    where=None, **kwargs):
+    """
+    Version of :func:`_array` that only keeps the rows passing the row
+    predicates (see :func:`_keep_row`), returning (indices, rows) where
+    `indices` are the positions in `genelist` of the kept rows.
+
+    Features are handled :data:`_normalize_chunksize` at a time, so only the
+    kept rows are held for all of `genelist`.
+    """
+    indices = []
+    biglist = []
+    start = 0
+    for chunk in chunker(genelist, _normalize_chunksize):
+        rows = _array(fn, cls, chunk, **kwargs)
+        for i, row in enumerate(rows):
+            if _keep_row(row, min_total=min_total, min_max=min_max,
+                         where=where):
+                indices.append(start + i)
+                biglist.append(row)
+        start += len(rows)
+        del rows
+    return np.array(indices, dtype=int), biglist
+
+
+def _array(fn, cls, genelist, scale=None, control=None,
+           comparefunc=np.subtract, transform=None, min_total=None,
+           min_max=None, where=None, **kwargs):
     """
     Returns a "meta-feature" array, with len(genelist) rows and `bins`
     cols.  Each row contains the number of reads falling in each bin of
     that row's modified feature.
+
+    If all features are single intervals of the same length and the default
+    interpolation binning is used, then the features are binned all at once
+    with :func:`_array_batched`.  Single-interval features of a bigWig file
+    using method="ucsc_summarize" are summarized all at once with
+    :func:`_array_ucsc_summarize`.
+
+    If any of `scale`, `control` or `transform` are given, then rows are
+    normalized as they are created; see :func:`_normalized_array`.
+
+    If any of `min_total`, `min_max` or `where` are given, then only rows
+    passing them are kept, and (indices, rows) is returned instead; see
+    :func:`_filtered_array`.
     """
+    if min_total is not None or min_max is not None or where is not None:
+        return _filtered_array(
+            fn, cls, genelist, min_total=min_total, min_max=min_max,
+            where=where, scale=scale, control=control,
+            comparefunc=comparefunc, transform=transform, **kwargs)
+    if scale is not None or control is not None or transform is not None:
+        return _normalized_array(
+            fn, cls, genelist, scale=scale, control=control,
+            comparefunc=comparefunc, transform=transform, **kwargs)
+    if kwargs.get('junctions'):
+        raise ArgumentError(
+            "junctions=True is only supported for local_coverage on a "
+            "single process")
     reader = cls(fn)
     _local_coverage_func = cls.local_coverage
     biglist = []
@@ -518,6 +1199,22 @@ def _array(fn, cls, genelist, **kwargs):
         if isinstance(kwargs['bins'], int):
             kwargs['bins'] = [kwargs['bins']]
 
+    genelist = list(genelist)
+    intervals = _uniform_features(reader, genelist, kwargs)
+    if intervals is not None:
+        return _array_batched(reader, cls, intervals, **kwargs)
+
+    if (
+        isinstance(reader.adapter, filetype_adapters.BigWigAdapter)
+        and kwargs.get('method') == 'ucsc_summarize'
+        and kwargs.get('function', 'mean') in ('mean', 'coverage')
+        and kwargs.get('bins') is not None
+        and len(kwargs['bins']) == 1
+    ):
+        intervals = _single_intervals(genelist)
+        if intervals is not None:
+            return _array_ucsc_summarize(reader, intervals, **kwargs)
+
     for gene in genelist:
         if not isinstance(gene, (list, tuple)):
             gene = [gene]
@@ -525,3 +1222,163 @@ def _array(fn, cls, genelist, **kwargs):
             reader, gene, **kwargs)
         biglist.append(coverage_y)
     return biglist
+
+
+def _uniform_features(reader, genelist, kwargs):
+    """
+    Returns `genelist` as a list of intervals if it is eligible for batched
+    binning by :func:`_array_batched`, otherwise returns None.
+
+    Eligible features are single intervals that all have the same length,
+    binned into a single `bins` value using the default interpolation method
+    (or method="get_as_array" for bigWig files), or one of the methods that
+    bin the full-resolution profile ("exact", "mean_offset_coverage",
+    "bin_covered").
+    """
+    bins = kwargs.get('bins')
+    if bins is None or len(bins) != 1 or bins[0] is None:
+        return None
+    if kwargs.get('group_by_tag'):
+        return None
+    method = kwargs.get('method')
+    if isinstance(reader.adapter, filetype_adapters.BigWigAdapter):
+        if method not in ('get_as_array',) + _full_resolution_methods:
+            return None
+    elif method not in (None,) + _full_resolution_methods:
+        return None
+    if method in ('mean_offset_coverage', 'bin_covered') and bins[0] <= 2:
+        return None
+
+    intervals = _single_intervals(genelist)
+    if intervals is None:
+        return None
+    size = intervals[0].stop - intervals[0].start
+    for gene in intervals:
+        if gene.stop - gene.start != size:
+            return None
+    return intervals
+
+
+def _single_intervals(genelist):
+    """
+    Returns `genelist` as a list of intervals if each feature is a single
+    interval (or a list containing one interval), otherwise returns None.
+    """
+    intervals = []
+    for gene in genelist:
+        if isinstance(gene, (list, tuple)):
+            if len(gene) != 1:
+                return None
+            gene = gene[0]
+        if isinstance(gene, basestring) and not helpers.coord_re.search(gene):
+            # let the per-feature path report the problem
+            return None
+        intervals.append(helpers.tointerval(gene))
+    if not intervals:
+        return None
+    return intervals
+
+
+def _array_ucsc_summarize(reader, genelist, bins, method=None, stranded=True,
+                          function='mean', **kwargs):
+    """
+    Version of :func:`_array` for bigWig files with method="ucsc_summarize",
+    which summarizes all features with a single run of bigWigAverageOverBed
+    (see
+    :meth:`metaseq.filetype_adapters.BigWigAdapter.ucsc_summarize_batch`).
+    """
+    _check_bigwig_kwargs(**kwargs)
+    if kwargs.get('zoom') is not None or kwargs.get('max_error') is not None:
+        raise ArgumentError(
+            "zoom and max_error are only supported for the default "
+            "method")
+    binned = reader.adapter.ucsc_summarize_batch(
+        genelist, bins[0], function=function)
+    if stranded:
+        minus = np.array([gene.strand == '-' for gene in genelist])
+        binned[minus] = binned[minus, ::-1]
+    return list(binned)
+
+
+def _array_batched(reader, cls, genelist, bins, method=None, stranded=True,
+                   accumulate=True, preserve_total=False, **kwargs):
+    """
+    Batched version of :func:`_array` for equal-length features.
+
+    The un-binned profiles for all features are stacked into a 2-D array,
+    which is then binned in a single vectorized call to
+    :func:`metaseq.helpers.rebin_rows` (or :func:`metaseq.helpers.bin_sums`
+    for method="exact", and :func:`_offset_bin_means` for
+    "mean_offset_coverage" and "bin_covered").  Results are the same as
+    binning each feature separately with :func:`_local_coverage`.
+
+    For bigWig files, the profiles are read with
+    :meth:`metaseq.filetype_adapters.BigWigAdapter.get_as_arrays`, which
+    reads nearby features together.
+    """
+    nbin = bins[0]
+    offset_method = method in ('mean_offset_coverage', 'bin_covered')
+    _local_coverage_func = cls.local_coverage
+    if isinstance(reader.adapter, filetype_adapters.BigWigAdapter):
+        _method = 'get_as_array'
+    else:
+        _method = None
+    size = genelist[0].stop - genelist[0].start
+    if _method == 'get_as_array':
+        # Read neighboring features together rather than one at a time
+        _check_bigwig_kwargs(preserve_total=preserve_total, **kwargs)
+        if isinstance(kwargs.get('function'), (list, tuple)):
+            raise ValueError(
+                'multiple functions are not supported for '
+                'method="get_as_array"')
+        if (
+            kwargs.get('zoom') is not None
+            or kwargs.get('max_error') is not None
+        ):
+            raise ArgumentError(
+                "zoom and max_error are only supported for the default "
+                "method")
+        profiles = np.array(reader.adapter.get_as_arrays(genelist),
+                            dtype=float)
+    else:
+        profiles = None
+        for i, gene in enumerate(genelist):
+            coverage_x, profile = _local_coverage_func(
+                reader, gene, bins=None, method=_method, stranded=False,
+                accumulate=accumulate, preserve_total=preserve_total,
+                **kwargs)
+            if profiles is None:
+                # (features, size) or, with split_strands,
+                # (features, 2, size)
+                profiles = np.empty((len(genelist),) + profile.shape)
+            profiles[i] = profile
+
+    if method == 'exact':
+        binned = helpers.bin_sums(profiles, nbin)
+        if not preserve_total:
+            binned /= float(size) / nbin
+        # totals are already exact
+        preserve_total = False
+    elif offset_method:
+        if preserve_total:
+            total = profiles.sum(axis=-1)
+        binned = _offset_bin_means(profiles, nbin)
+        if method == 'bin_covered':
+            binned[binned != 0] = 1
+    else:
+        if preserve_total:
+            total = profiles.sum(axis=-1)
+        binned = helpers.rebin_rows(profiles, nbin)
+    del profiles
+
+    if not accumulate and not offset_method:
+        binned[binned != 0] = 1
+
+    if stranded:
+        minus = np.array([gene.strand == '-' for gene in genelist])
+        binned[minus] = binned[minus, ..., ::-1]
+
+    if preserve_total:
+        scale = binned.sum(axis=-1) / total
+        binned /= scale[..., None]
+    return list(binned)
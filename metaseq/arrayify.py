@@ -2,10 +2,10 @@
 Helper functions for converting genome-wide data into large NumPy arrays
 """
 import os
-import pandas
 import pybedtools
 import numpy as np
 import _genomic_signal
+import filetype_adapters
 
 
 class Binner(object):
@@ -119,24 +119,19 @@ class Binner(object):
 
         outfiles = []
         for chrom in self.chroms:
-            tmp_output = pybedtools.BedTool._tmp()
             windows = self.make_windows(chrom)
 
             outfile = os.path.join(
                 outdir,
                 '{basename}.{chrom}.{windowsize}.{metric}'.format(**locals())
                 + '.npz')
-            cmds = [
-                'bigWigAverageOverBed',
-                bigwig,
-                windows,
-                tmp_output]
-            os.system(' '.join(cmds))
-            names = ['name', 'size', 'covered', 'sum', 'mean0', 'mean']
-            df = pandas.read_table(tmp_output, names=names)
-            x = df.size.cumsum() - df.size / 2
-            y = df[metric]
+            names, values = filetype_adapters.bigwig_average_over_bed(
+                bigwig, windows)
+            columns = filetype_adapters.average_over_bed_columns
+            size = values[:, columns.index('size')]
+            x = size.cumsum() - size / 2
+            y = values[:, columns.index(metric)]
             np.savez(outfile, x=x, y=y)
             outfiles.append(outfile)
-            del x, y, df
+            del x, y, values
         return outfiles
@@ -0,0 +1,445 @@
+"""
+Native reader for bigWig and bigBed ("bbi") files.
+
+Files are memory-mapped, and the header, chromosome B+ tree and R-tree index
+are parsed with NumPy structured dtypes when the file is opened.  Data blocks
+are decompressed into NumPy arrays on demand and kept in a module-level LRU
+cache that is shared by all open files, so overlapping or repeated queries
+only decompress each block once.
+
+This is used by :class:`metaseq.filetype_adapters.BigWigAdapter` and
+:class:`metaseq.filetype_adapters.BigBedAdapter` for full-resolution access;
+bx-python is still used for summarizing bigWig files.
+
+The file format is described in Kent et al. (2010) Bioinformatics 26(17),
+doi:10.1093/bioinformatics/btq351.
+"""
+import os
+import mmap
+import struct
+import zlib
+from collections import OrderedDict
+import numpy as np
+
+BIGWIG_MAGIC = 0x888FFC26
+BIGBED_MAGIC = 0x8789F2EB
+CHROM_TREE_MAGIC = 0x78CA8C91
+R_TREE_MAGIC = 0x2468ACE0
+
+# Maximum number of decompressed blocks kept in the cache
+block_cache_size = 512
+
+# (file key, block offset) -> decoded block
+_block_cache = OrderedDict()
+
+_header_fields = [
+    ('magic', 'u4'),
+    ('version', 'u2'),
+    ('zoom_levels', 'u2'),
+    ('chrom_tree_offset', 'u8'),
+    ('full_data_offset', 'u8'),
+    ('full_index_offset', 'u8'),
+    ('field_count', 'u2'),
+    ('defined_field_count', 'u2'),
+    ('auto_sql_offset', 'u8'),
+    ('total_summary_offset', 'u8'),
+    ('uncompress_buf_size', 'u4'),
+    ('extension_offset', 'u8'),
+]
+
+_zoom_header_fields = [
+    ('reduction_level', 'u4'),
+    ('reserved', 'u4'),
+    ('data_offset', 'u8'),
+    ('index_offset', 'u8'),
+]
+
+_chrom_tree_header_fields = [
+    ('magic', 'u4'),
+    ('block_size', 'u4'),
+    ('key_size', 'u4'),
+    ('val_size', 'u4'),
+    ('item_count', 'u8'),
+    ('reserved', 'u8'),
+]
+
+_r_tree_header_fields = [
+    ('magic', 'u4'),
+    ('block_size', 'u4'),
+    ('item_count', 'u8'),
+    ('start_chrom', 'u4'),
+    ('start_base', 'u4'),
+    ('end_chrom', 'u4'),
+    ('end_base', 'u4'),
+    ('end_file_offset', 'u8'),
+    ('items_per_slot', 'u4'),
+    ('reserved', 'u4'),
+]
+
+# Header shared by nodes of both trees
+_node_header_fields = [
+    ('is_leaf', 'u1'),
+    ('reserved', 'u1'),
+    ('count', 'u2'),
+]
+
+_r_tree_node_fields = [
+    ('start_chrom', 'u4'),
+    ('start_base', 'u4'),
+    ('end_chrom', 'u4'),
+    ('end_base', 'u4'),
+    ('offset', 'u8'),
+]
+
+_r_tree_leaf_fields = _r_tree_node_fields + [('size', 'u8')]
+
+_wig_header_fields = [
+    ('chrom', 'u4'),
+    ('start', 'u4'),
+    ('end', 'u4'),
+    ('item_step', 'u4'),
+    ('item_span', 'u4'),
+    ('type', 'u1'),
+    ('reserved', 'u1'),
+    ('count', 'u2'),
+]
+
+# bigWig section types
+_BEDGRAPH, _VARIABLE_STEP, _FIXED_STEP = 1, 2, 3
+
+_wig_item_fields = {
+    _BEDGRAPH: [('start', 'u4'), ('end', 'u4'), ('value', 'f4')],
+    _VARIABLE_STEP: [('start', 'u4'), ('value', 'f4')],
+    _FIXED_STEP: [('value', 'f4')],
+}
+
+
+def _position(chrom_id, base):
+    """
+    (chrom_id, base) pairs as single int64 positions that sort in the same
+    order.
+    """
+    return (np.asarray(chrom_id, dtype=np.int64) << 32) \
+        + np.asarray(base, dtype=np.int64)
+
+
+def _dtype(fields, endian):
+    """
+    Structured dtype from a list of (name, type) `fields` with the byte order
+    `endian` ('<' or '>').
+    """
+    return np.dtype([(name, endian + code) for name, code in fields])
+
+
+def clear_block_cache():
+    """
+    Removes all decompressed blocks from the cache.
+    """
+    _block_cache.clear()
+
+
+class BBIFile(object):
+    """
+    Base class for memory-mapped bigWig and bigBed files.  Subclasses set
+    `magic` and define `_decode_block`.
+    """
+    magic = None
+
+    def __init__(self, fn):
+        self.fn = fn
+        f = open(fn, 'rb')
+        try:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            f.close()
+        stat = os.stat(fn)
+        self._key = (os.path.abspath(fn), stat.st_size, stat.st_mtime)
+
+        magic = struct.unpack('<I', self._mmap[:4])[0]
+        if magic == self.magic:
+            self.endian = '<'
+        elif struct.unpack('>I', self._mmap[:4])[0] == self.magic:
+            self.endian = '>'
+        else:
+            raise ValueError(
+                '%s is not a %s file' % (fn, self.__class__.__name__))
+
+        self.header = self._read(_header_fields, 0)
+        self.zoom_levels = self._read(
+            _zoom_header_fields, 64, self.header['zoom_levels'])
+        self.chroms = self._read_chrom_tree(self.header['chrom_tree_offset'])
+        self.blocks = self._read_r_tree(self.header['full_index_offset'])
+        self._index_blocks()
+
+    def _index_blocks(self):
+        """
+        Finds block starts, and the furthest end of any block up to and
+        including each one, as single sortable positions.  Since blocks are
+        sorted by start, these find the blocks overlapping a region with
+        a binary search rather than checking every block.
+        """
+        self._block_starts = _position(
+            self.blocks['start_chrom'], self.blocks['start_base'])
+        self._block_max_ends = np.maximum.accumulate(_position(
+            self.blocks['end_chrom'], self.blocks['end_base']))
+
+    def _read(self, fields, offset, count=None):
+        """
+        Reads `count` records of `fields` starting at `offset`; if `count` is
+        None, reads a single record.
+        """
+        dtype = _dtype(fields, self.endian)
+        if count is None:
+            return np.frombuffer(self._mmap, dtype, 1, int(offset))[0]
+        return np.frombuffer(self._mmap, dtype, int(count), int(offset))
+
+    def _read_chrom_tree(self, offset):
+        """
+        Returns a dictionary of {chrom: (chrom_id, chrom_size)} from the B+
+        tree at `offset`.
+        """
+        header = self._read(_chrom_tree_header_fields, offset)
+        if header['magic'] != CHROM_TREE_MAGIC:
+            raise ValueError('%s: bad chromosome tree' % self.fn)
+        key = ('key', 'S%s' % header['key_size'])
+        leaf_dtype = np.dtype([
+            key, ('id', self.endian + 'u4'), ('size', self.endian + 'u4')])
+        node_dtype = np.dtype([key, ('offset', self.endian + 'u8')])
+
+        chroms = {}
+        nodes = [int(offset) + 32]
+        while nodes:
+            node = nodes.pop()
+            node_header = self._read(_node_header_fields, node)
+            count = int(node_header['count'])
+            if node_header['is_leaf']:
+                items = np.frombuffer(self._mmap, leaf_dtype, count, node + 4)
+                for item in items:
+                    chroms[item['key']] = (int(item['id']), int(item['size']))
+            else:
+                items = np.frombuffer(self._mmap, node_dtype, count, node + 4)
+                nodes.extend(int(i) for i in items['offset'])
+        return chroms
+
+    def _read_r_tree(self, offset):
+        """
+        Returns all leaves of the R-tree at `offset` -- one per data block --
+        as a structured array sorted by position.
+        """
+        header = self._read(_r_tree_header_fields, offset)
+        if header['magic'] != R_TREE_MAGIC:
+            raise ValueError('%s: bad R-tree index' % self.fn)
+        leaves = []
+        nodes = [int(offset) + 48]
+        while nodes:
+            node = nodes.pop()
+            node_header = self._read(_node_header_fields, node)
+            if node_header['is_leaf']:
+                leaves.append(self._read(
+                    _r_tree_leaf_fields, node + 4, node_header['count']))
+            else:
+                items = self._read(
+                    _r_tree_node_fields, node + 4, node_header['count'])
+                nodes.extend(int(i) for i in items['offset'])
+        if leaves:
+            blocks = np.concatenate(leaves)
+        else:
+            blocks = np.zeros(0, _dtype(_r_tree_leaf_fields, self.endian))
+        blocks = blocks.astype(_dtype(_r_tree_leaf_fields, '='))
+        return blocks[np.lexsort((blocks['start_base'],
+                                  blocks['start_chrom']))]
+
+    def _overlapping_blocks(self, chrom_id, start, end):
+        """
+        Returns the blocks of the R-tree that overlap chrom_id:start-end.
+        """
+        lo = np.searchsorted(
+            self._block_max_ends, _position(chrom_id, start), side='right')
+        hi = np.searchsorted(
+            self._block_starts, _position(chrom_id, end), side='left')
+        b = self.blocks[lo:hi]
+        mask = (
+            (
+                (b['start_chrom'] < chrom_id)
+                | ((b['start_chrom'] == chrom_id) & (b['start_base'] < end))
+            ) & (
+                (b['end_chrom'] > chrom_id)
+                | ((b['end_chrom'] == chrom_id) & (b['end_base'] > start))
+            )
+        )
+        return b[mask]
+
+    def _block(self, offset, size):
+        """
+        Returns the decoded data block at `offset`, using the block cache.
+        """
+        key = (self._key, offset)
+        try:
+            block = _block_cache.pop(key)
+        except KeyError:
+            data = self._mmap[offset:offset + size]
+            if self.header['uncompress_buf_size'] > 0:
+                data = zlib.decompress(data)
+            block = self._decode_block(data)
+        _block_cache[key] = block
+        while len(_block_cache) > block_cache_size:
+            _block_cache.popitem(last=False)
+        return block
+
+    def _decode_block(self, data):
+        raise NotImplementedError
+
+    def _records(self, chrom, start, end):
+        """
+        Generator of (chrom_id, starts, ends, extra) for each data block
+        overlapping chrom:start-end.
+        """
+        chrom_id = self.chroms[chrom][0]
+        for block in self._overlapping_blocks(chrom_id, start, end):
+            yield self._block(int(block['offset']), int(block['size']))
+
+    def close(self):
+        self._mmap.close()
+
+
+class BigWigFile(BBIFile):
+    """
+    Memory-mapped bigWig file.
+    """
+    magic = BIGWIG_MAGIC
+
+    def _decode_block(self, data):
+        """
+        Returns (chrom_ids, starts, ends, values) arrays for a bigWig data
+        block.
+        """
+        header = np.frombuffer(
+            data, _dtype(_wig_header_fields, self.endian), 1)[0]
+        count = int(header['count'])
+        kind = int(header['type'])
+        if kind not in _wig_item_fields:
+            raise ValueError(
+                '%s: unknown bigWig section type %s' % (self.fn, kind))
+        items = np.frombuffer(
+            data, _dtype(_wig_item_fields[kind], self.endian), count, 24)
+        if kind == _FIXED_STEP:
+            starts = header['start'] + np.arange(count, dtype=np.int64) \
+                * header['item_step']
+        else:
+            starts = items['start'].astype(np.int64)
+        if kind == _BEDGRAPH:
+            ends = items['end'].astype(np.int64)
+        else:
+            ends = starts + header['item_span']
+        chrom_ids = np.repeat(np.uint32(header['chrom']), count)
+        return chrom_ids, starts, ends, items['value'].astype(np.float32)
+
+    def get_as_array(self, chrom, start, end):
+        """
+        Returns the values at each position of chrom:start-end as a float32
+        array, with NaN where there is no data, or None if `chrom` is not in
+        the file.  Same as bx-python's BigWigFile.get_as_array.
+        """
+        if start >= end or chrom not in self.chroms:
+            return None
+        chrom_id = self.chroms[chrom][0]
+        values = np.empty(end - start, dtype=np.float32)
+        values.fill(np.nan)
+        for chrom_ids, starts, ends, vals in self._records(chrom, start, end):
+            keep = (chrom_ids == chrom_id) & (starts < end) & (ends > start)
+            if not keep.any():
+                continue
+            s = np.maximum(starts[keep], start) - start
+            e = np.minimum(ends[keep], end) - start
+            lengths = e - s
+
+            # position of every covered base, and the value of its item
+            within = np.arange(lengths.sum()) - np.repeat(
+                np.cumsum(lengths) - lengths, lengths)
+            values[np.repeat(s, lengths) + within] = np.repeat(
+                vals[keep], lengths)
+        return values
+
+
+class BigBedFile(BBIFile):
+    """
+    Memory-mapped bigBed file.
+    """
+    magic = BIGBED_MAGIC
+
+    def _decode_block(self, data):
+        """
+        Returns (chrom_ids, starts, ends, rest, strands, scores) for a bigBed
+        data block, where `rest` is a list of the tab-separated fields after
+        the third for each record.  `strands` and `scores` are the strand
+        ("." if missing) and score (NaN if missing or not a number) columns
+        of `rest`, decoded here so that they are cached with the block.
+        """
+        fmt = self.endian + 'III'
+        chrom_ids, starts, ends, rest, strands, scores = [], [], [], [], [], []
+        pos = 0
+        n = len(data)
+        while pos < n:
+            chrom_id, start, end = struct.unpack_from(fmt, data, pos)
+            stop = data.index('\0', pos + 12)
+            chrom_ids.append(chrom_id)
+            starts.append(start)
+            ends.append(end)
+            record = data[pos + 12:stop]
+            rest.append(record)
+            fields = record.split('\t', 3)
+            try:
+                scores.append(float(fields[1]))
+            except (IndexError, ValueError):
+                scores.append(np.nan)
+            if len(fields) > 2:
+                strands.append(fields[2])
+            else:
+                strands.append('.')
+            pos = stop + 1
+        return (
+            np.array(chrom_ids, dtype=np.uint32),
+            np.array(starts, dtype=np.int64),
+            np.array(ends, dtype=np.int64),
+            rest,
+            np.array(strands, dtype='S1'),
+            np.array(scores, dtype=float))
+
+    def get(self, chrom, start, end):
+        """
+        Returns a list of (start, end, rest) tuples for the records
+        overlapping chrom:start-end, where `rest` is a string of the
+        tab-separated fields after the third, or None if `chrom` is not in
+        the file.
+        """
+        if start >= end or chrom not in self.chroms:
+            return None
+        chrom_id = self.chroms[chrom][0]
+        records = []
+        for block in self._records(chrom, start, end):
+            chrom_ids, starts, ends, rest = block[:4]
+            keep = (chrom_ids == chrom_id) & (starts < end) & (ends > start)
+            for i in np.nonzero(keep)[0]:
+                records.append((int(starts[i]), int(ends[i]), rest[i]))
+        return records
+
+    def get_columns(self, chrom, start, end):
+        """
+        Returns (starts, ends, strands, scores) arrays for the records
+        overlapping chrom:start-end, without creating an object per record.
+        Arrays are empty if there are no such records.
+        """
+        columns = [
+            [np.zeros(0, dtype=np.int64)],
+            [np.zeros(0, dtype=np.int64)],
+            [np.zeros(0, dtype='S1')],
+            [np.zeros(0, dtype=float)]]
+        if start < end and chrom in self.chroms:
+            chrom_id = self.chroms[chrom][0]
+            for block in self._records(chrom, start, end):
+                chrom_ids, starts, ends, rest, strands, scores = block
+                keep = (
+                    (chrom_ids == chrom_id) & (starts < end) & (ends > start))
+                for i, column in enumerate((starts, ends, strands, scores)):
+                    columns[i].append(column[keep])
+        return tuple(np.concatenate(i) for i in columns)
@@ -12,19 +12,48 @@ an iterator of pybedtools.Intervals
 Subclasses must define make_fileobj(), which returns an object to be iterated
 over in __getitem__
 """
-from bx.bbi.bigbed_file import BigBedFile
 from bx.bbi.bigwig_file import BigWigFile
-from bx.intervals.io import StrandFormatError
 import numpy as np
 import subprocess
 import pysam
 import pybedtools
 import os
 import sys
-from textwrap import dedent
+import zlib
+import heapq
+from collections import namedtuple
+import bbi
 
 strand_lookup = {16: '-', 0: '+'}
 
+# Columns returned by fetch_arrays()
+interval_dtype = np.dtype([
+    ('start', np.int64),
+    ('stop', np.int64),
+    ('strand', 'S1'),
+    ('score', float),
+])
+
+# Splice junctions returned by BamAdapter.fetch_arrays(..., junctions=True).
+# donor and acceptor are the 0-based start and end of the intron on the
+# reference, so donor < acceptor regardless of strand.
+junction_dtype = np.dtype([
+    ('donor', np.int64),
+    ('acceptor', np.int64),
+    ('strand', 'S1'),
+    ('count', np.int64),
+])
+
+
+def _subsampled(name, fraction):
+    """
+    True if the item identified by the string `name` is in a deterministic
+    subsample of about `fraction` of all items.  The decision only depends on
+    a hash of `name`, so the same items are kept across windows, processes
+    and runs.
+    """
+    return (zlib.crc32(name) & 0xffffffff) < fraction * 0x100000000
+
 
 class BaseAdapter(object):
     """
@@ -38,39 +67,253 @@ class BaseAdapter(object):
     def __getitem__(self, key):
         raise ValueError('Subclasses must define __getitem__')
 
+    def fetch_arrays(self, key, subsample=None):
+        """
+        Returns the features overlapping the interval `key` as a structured
+        array with :data:`interval_dtype`.  Scores that are missing or not
+        numbers are NaN.
+
+        If `subsample` is not None, then only a deterministic subset of about
+        that fraction of the features is returned, chosen by hashing each
+        feature's line.
+
+        This version is built from __getitem__; subclasses can override it to
+        decode features directly into arrays.
+        """
+        records = []
+        for interval in self[key]:
+            if subsample is not None and not _subsampled(
+                    str(interval), subsample):
+                continue
+            try:
+                score = float(interval.score)
+            except ValueError:
+                score = np.nan
+            records.append(
+                (interval.start, interval.stop, interval.strand, score))
+        return np.array(records, dtype=interval_dtype)
+
     def make_fileobj(self):
         raise ValueError('Subclasses must define make_fileobj')
 
 
+def _aligned_blocks(read):
+    """
+    Generator of (start, stop) for each aligned ("M") block of a pysam read.
+    """
+    start = read.pos
+    curr_end = read.pos
+    for op, bp in read.cigar:
+        start = curr_end
+        curr_end += bp
+        if op == 0:
+            yield start, curr_end
+
+
+# CIGAR operations that consume the reference: M, D, N, =, X
+_reference_ops = set([0, 2, 3, 7, 8])
+
+
+def _introns(read):
+    """
+    Generator of (start, stop) for each skipped region ("N" operation, i.e.,
+    an intron) of a pysam read.
+    """
+    pos = read.pos
+    for op, bp in read.cigar:
+        if op == 3:
+            yield pos, pos + bp
+        if op in _reference_ops:
+            pos += bp
+
+
+def _read_tag(read, tag):
+    """
+    Value of the optional field `tag` of a pysam read, or None if the read
+    does not have it.
+    """
+    try:
+        return read.opt(tag)
+    except KeyError:
+        return None
+
+
+def _junction_strand(read):
+    """
+    Strand of the transcript a spliced read came from.  Uses the XS tag set
+    by most spliced aligners if present, otherwise the strand of the read.
+    """
+    return _read_tag(read, 'XS') or strand_lookup[read.flag & 0x0010]
+
+
+def _junction_table(counts):
+    """
+    Converts a dictionary of (donor, acceptor, strand) -> count into a
+    structured array with :data:`junction_dtype`, sorted by position.
+    """
+    return np.array(
+        [key + (count,) for key, count in sorted(counts.items())],
+        dtype=junction_dtype)
+
+
 class BamAdapter(BaseAdapter):
     """
     Adapter that provides random access to BAM objects using Pysam
+
+    Reads with a mapping quality less than `min_mapq`, without all of the
+    bits of `require_flags` set, or with any of the bits of `exclude_flags`
+    set in their SAM flag are skipped; e.g., exclude_flags=0x400 skips
+    duplicates and exclude_flags=0x100 skips secondary alignments.  These
+    filters are checked on the pysam records, before any intervals are
+    created.
+
+    Methods that take filters also accept `subsample`, which keeps
+    a deterministic subset of about that fraction of reads, chosen by
+    hashing read names so that both mates of a pair are kept or skipped
+    together.
     """
-    def __init__(self, fn):
+    def __init__(self, fn, min_mapq=0, require_flags=0, exclude_flags=0):
         super(BamAdapter, self).__init__(fn)
+        self.min_mapq = min_mapq
+        self.require_flags = require_flags
+        self.exclude_flags = exclude_flags
 
     def make_fileobj(self):
         return pysam.Samfile(self.fn, 'rb')
 
-    def __getitem__(self, key):
+    def reads(self, key, min_mapq=None, require_flags=None,
+              exclude_flags=None, subsample=None):
+        """
+        Generator of the pysam reads overlapping the interval `key` that pass
+        the filters.  Filters that are None default to those the adapter was
+        created with.
+        """
+        if min_mapq is None:
+            min_mapq = self.min_mapq
+        if require_flags is None:
+            require_flags = self.require_flags
+        if exclude_flags is None:
+            exclude_flags = self.exclude_flags
         iterator = self.fileobj.fetch(
             str(key.chrom),
             key.start,
             key.stop)
         for r in iterator:
-            start = r.pos
-            curr_end = r.pos
-            for op, bp in r.cigar:
-                start = curr_end
-                curr_end += bp
-                if op == 0:
-                    interval = pybedtools.Interval(
-                        self.fileobj.references[r.rname],
-                        start,
-                        curr_end,
-                        strand=strand_lookup[r.flag & 0x0010])
-                    interval.file_type = 'bed'
-                    yield interval
+            if min_mapq and r.mapq < min_mapq:
+                continue
+            if (r.flag & require_flags) != require_flags:
+                continue
+            if r.flag & exclude_flags:
+                continue
+            if subsample is not None and not _subsampled(r.qname, subsample):
+                continue
+            yield r
+
+    def __getitem__(self, key):
+        for r in self.reads(key):
+            for start, stop in _aligned_blocks(r):
+                interval = pybedtools.Interval(
+                    self.fileobj.references[r.rname],
+                    start,
+                    stop,
+                    strand=strand_lookup[r.flag & 0x0010])
+                interval.file_type = 'bed'
+                yield interval
+
+    def fetch_arrays(self, key, paired_fragments=False, max_fragment_size=None,
+                     junctions=False, group_by_tag=None, whole_reads=False,
+                     **filters):
+        """
+        Returns the aligned blocks of the reads overlapping the interval
+        `key` as a structured array with :data:`interval_dtype`, built
+        directly from the pysam reads.  Additional keyword arguments are
+        filters passed to :meth:`reads`.
+
+        If `paired_fragments` is True, then each row is instead a whole
+        fragment of a paired-end library, built from the template length
+        (TLEN) of properly-paired first mates so that each fragment is only
+        reported once.  The strand of a fragment is the strand of its first
+        mate.  Fragments longer than `max_fragment_size` are skipped.  Note
+        that only fragments whose first mate overlaps `key` are reported, so
+        callers should pad `key` by `max_fragment_size` to find all the
+        fragments that overlap a region.
+
+        If `junctions` is True, then the splice junctions ("N" operations) of
+        the same reads are counted during the same pass, and a tuple of
+        (blocks, junctions) is returned, where `junctions` is a structured
+        array with :data:`junction_dtype` holding one row per distinct
+        (donor, acceptor, strand).  Junctions are counted for every read
+        overlapping `key`, even if the intron itself lies outside `key`.
+        Cannot be combined with `paired_fragments`.
+
+        If `group_by_tag` is the name of a SAM tag (e.g., "CB" for cell
+        barcodes or "RG" for read groups), then a tuple of (blocks, tags) is
+        returned instead, where `tags` is an object array holding the value
+        of that tag for the read each row came from (None if the read has no
+        such tag).  Cannot be combined with `junctions`.
+
+        If `whole_reads` is True, then each row spans a whole read, from the
+        first to the last reference position it is aligned to, instead of
+        one row per aligned block.  This is cheaper to decode and gives the
+        5' end of spliced or gapped reads, e.g., for finding cut sites.
+        """
+        if junctions and paired_fragments:
+            raise ValueError(
+                "junctions cannot be used with paired_fragments=True")
+        if junctions and group_by_tag:
+            raise ValueError(
+                "junctions cannot be used with group_by_tag")
+        records = []
+        tags = []
+        if not paired_fragments:
+            counts = {}
+            for r in self.reads(key, **filters):
+                strand = strand_lookup[r.flag & 0x0010]
+                if group_by_tag:
+                    tag = _read_tag(r, group_by_tag)
+                if whole_reads:
+                    blocks = [(r.pos, r.aend)]
+                else:
+                    blocks = _aligned_blocks(r)
+                for start, stop in blocks:
+                    records.append((start, stop, strand, np.nan))
+                    if group_by_tag:
+                        tags.append(tag)
+                if junctions:
+                    for start, stop in _introns(r):
+                        junction = (start, stop, _junction_strand(r))
+                        counts[junction] = counts.get(junction, 0) + 1
+            records = np.array(records, dtype=interval_dtype)
+            if junctions:
+                return records, _junction_table(counts)
+        else:
+            for r in self.reads(key, **filters):
+                flag = r.flag
+                # paired, proper pair, first mate; not unmapped, secondary or
+                # supplementary
+                if (flag & 0x43) != 0x43 or flag & 0x90c:
+                    continue
+                tlen = r.tlen
+                if tlen == 0:
+                    continue
+                if (
+                    max_fragment_size is not None
+                    and abs(tlen) > max_fragment_size
+                ):
+                    continue
+                if tlen > 0:
+                    start = r.pos
+                else:
+                    # the mate is the leftmost read of the pair
+                    start = r.mpos
+                records.append((start, start + abs(tlen),
+                                strand_lookup[flag & 0x0010], np.nan))
+                if group_by_tag:
+                    tags.append(_read_tag(r, group_by_tag))
+            records = np.array(records, dtype=interval_dtype)
+        if group_by_tag:
+            return records, np.array(tags, dtype=object)
+        return records
 
 
 class BedAdapter(BaseAdapter):
@@ -105,57 +348,302 @@ class BedAdapter(BaseAdapter):
 
 class BigBedAdapter(BaseAdapter):
     """
-    Adapter that provides random access to bigBed files via bx-python
+    Adapter that provides random access to bigBed files via
+    :mod:`metaseq.bbi`
     """
     def __init__(self, fn):
         super(BigBedAdapter, self).__init__(fn)
 
     def make_fileobj(self):
-        return BigBedFile(open(self.fn))
+        return bbi.BigBedFile(self.fn)
 
     def __getitem__(self, key):
         chrom = key.chrom
         start = key.start
         stop = key.end
-        try:
-            bx_intervals = self.fileobj.get(chrom, start, stop)
-        except StrandFormatError:
-            raise NotImplementedError(dedent(
-                """
-                It appears you have a version of bx-python where bigBed files
-                are temporarily unsupported due to recent changes in the
-                bx-python dependency. In the meantime, please convert bigBed to
-                BAM like this:
-
-                    bigBedToBed {0} tmp.bed
-                    bedtools bedtobam -i tmp.bed > {0}.bam
-
-                and create a genomic signal object using this {0}.bam file.
-                """.format(self.fn)))
-        if bx_intervals is None:
+        records = self.fileobj.get(chrom, start, stop)
+        if records is None:
             raise StopIteration
-        for i in bx_intervals:
-            interval = pybedtools.create_interval_from_list(i.fields)
+        for s, e, rest in records:
+            fields = [chrom, str(s), str(e)]
+            if rest:
+                fields.extend(rest.split('\t'))
+            interval = pybedtools.create_interval_from_list(fields)
             interval.file_type = 'bed'
             yield interval
 
+    def fetch_arrays(self, key):
+        starts, stops, strands, scores = self.fileobj.get_columns(
+            key.chrom, key.start, key.end)
+        records = np.empty(len(starts), dtype=interval_dtype)
+        records['start'] = starts
+        records['stop'] = stops
+        records['strand'] = strands
+        records['score'] = scores
+        return records
+
+    fetch_arrays.__doc__ = BaseAdapter.fetch_arrays.__doc__
+
+
+# Per-bin totals aggregated from zoom-level summaries; has the same attributes
+# as the summaries returned by bx-python.
+_Summary = namedtuple(
+    '_Summary',
+    ['valid_count', 'sum_data', 'sum_squares', 'min_val', 'max_val'])
+
+
+def _summary_statistic(summary, function, bin_size):
+    """
+    Extracts the statistic named by `function` from a bx-python summary, where
+    each bin is `bin_size` bp.
+    """
+    if function == 'sum':
+        return summary.sum_data
+    if function == 'mean':
+        s = summary.sum_data / summary.valid_count
+        s[np.isnan(s)] = 0
+        return s
+    if function == 'min':
+        s = summary.min_val.copy()
+        s[np.isinf(s)] = 0
+        return s
+    if function == 'max':
+        s = summary.max_val.copy()
+        s[np.isinf(s)] = 0
+        return s
+    if function == 'std':
+        s = (summary.sum_squares / summary.valid_count)
+        s[np.isnan(s)] = 0
+        return s
+    if function == 'coverage':
+        return summary.valid_count / bin_size
+    raise ValueError('unsupported function "%s"' % function)
+
+
+# Columns reported by bigWigAverageOverBed, after the name column
+average_over_bed_columns = ['size', 'covered', 'sum', 'mean0', 'mean']
+
+
+def bigwig_average_over_bed(bigwig, bed):
+    """
+    Runs UCSC's bigWigAverageOverBed on the BED file `bed`, which must have
+    a unique name for each feature, and returns `(names, values)`.
+
+    `names` is a list of the feature names and `values` is a 2-D array with
+    one row per feature and the columns in :data:`average_over_bed_columns`,
+    both in the order reported by bigWigAverageOverBed.
+    """
+    output = pybedtools.BedTool._tmp()
+    cmds = ['bigWigAverageOverBed', bigwig, bed, output]
+    p = subprocess.Popen(
+        cmds,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    stdout, stderr = p.communicate()
+    if p.returncode != 0:
+        raise ValueError("cmds: %s: %s" % (' '.join(cmds), stderr))
+    names = []
+    values = []
+    for line in open(output):
+        fields = line.rstrip('\n').split('\t')
+        names.append(fields[0])
+        values.append([float(i) for i in fields[1:]])
+    os.unlink(output)
+    values = np.array(values, dtype=float).reshape(
+        -1, len(average_over_bed_columns))
+    return names, values
+
 
 class BigWigAdapter(BaseAdapter):
     """
-    Adapter that provides random access to bigWig files bia bx-python
+    Adapter that provides random access to bigWig files via bx-python and
+    :mod:`metaseq.bbi`
     """
     def __init__(self, fn):
         super(BigWigAdapter, self).__init__(fn)
+        self._bigwig = None
+        self._native = None
+        self.last_zoom_level = None
 
     def make_fileobj(self):
         return self.fn
 
+    def bigwig_file(self):
+        """
+        Returns a bx BigWigFile for this file, which is opened on first use
+        and then re-used for subsequent queries.
+        """
+        if self._bigwig is None:
+            self._bigwig = BigWigFile(open(self.fn))
+        return self._bigwig
+
+    def native_file(self):
+        """
+        Returns a :class:`metaseq.bbi.BigWigFile` for this file, which is
+        opened on first use and then re-used for subsequent queries.
+        """
+        if self._native is None:
+            self._native = bbi.BigWigFile(self.fn)
+        return self._native
+
+    def zoom_levels(self):
+        """
+        Returns the reduction levels (in bp) of the zoom levels stored in the
+        file, from finest to coarsest.
+        """
+        return sorted(i.reduction_level for i in self.bigwig_file().level_list)
+
+    def zoom_level(self, bin_size, zoom=None, max_error=None):
+        """
+        Returns the reduction level (in bp) of the coarsest zoom level that
+        meets the requested resolution, or 0 if the full-resolution data are
+        needed.
+
+        `zoom` is the coarsest resolution to accept, in bp.  Alternatively,
+        `max_error` is the coarsest resolution to accept as a fraction of
+        `bin_size`; e.g., with 10-kb bins, max_error=0.1 accepts zoom levels
+        of up to 1 kb.
+        """
+        if zoom is None:
+            if max_error is None:
+                raise ValueError('one of zoom or max_error is required')
+            zoom = max_error * bin_size
+        levels = [i for i in self.zoom_levels() if i <= zoom]
+        if not levels:
+            return 0
+        return max(levels)
+
+    def _chrom_id(self, chrom):
+        """
+        Looks up the numeric id used for `chrom` in the file's index, or None
+        if the chromosome is not in the file.
+        """
+        chroms = self.native_file().chroms
+        if chrom not in chroms:
+            return None
+        return chroms[chrom][0]
+
+    def _zoom_summary(self, level, interval, bins):
+        """
+        Aggregates the zoom-level summaries of `interval` stored at reduction
+        level `level` into `bins` bins.  Bins are laid out the same way as
+        bx-python's summarize().
+        """
+        chrom_id = self._chrom_id(interval.chrom)
+        if chrom_id is None:
+            return None
+        zoom = [i for i in self.bigwig_file().level_list
+                if i.reduction_level == level][0]
+        blocks = zoom._summary_blocks_in_region(
+            chrom_id, interval.start, interval.stop)
+        fields = [
+            np.array([getattr(b, attr) for b in blocks], dtype=float)
+            for attr in ('start', 'end', 'valid_count', 'sum_data',
+                         'sum_squares', 'min_val', 'max_val')]
+        bstart, bstop, valid_count, sum_data, sum_squares, min_val, max_val \
+            = fields
+
+        step = (interval.stop - interval.start) // bins
+        edges = interval.start + step * np.arange(bins + 1)
+
+        # (blocks, bins) fraction of each block falling in each bin
+        overlap = (
+            np.minimum(bstop[:, None], edges[None, 1:])
+            - np.maximum(bstart[:, None], edges[None, :-1])).clip(0)
+        overlaps = overlap > 0
+        frac = overlap / (bstop - bstart)[:, None]
+
+        return _Summary(
+            valid_count=np.dot(valid_count, frac),
+            sum_data=np.dot(sum_data, frac),
+            sum_squares=np.dot(sum_squares, frac),
+            min_val=np.where(overlaps, min_val[:, None], np.inf).min(
+                axis=0, initial=np.inf),
+            max_val=np.where(overlaps, max_val[:, None], -np.inf).max(
+                axis=0, initial=-np.inf),
+        )
+
+    def get_as_arrays(self, intervals, max_gap=10000, max_span=1000000):
+        """
+        Full-resolution signal for each of `intervals`, as a list of arrays in
+        the same order as `intervals`.
+
+        Rather than querying each interval separately, intervals are sorted
+        by position within each chromosome and neighboring intervals -- those
+        that overlap or are separated by at most `max_gap` bp -- are merged
+        into spans of at most `max_span` bp.  Each span is read with a single
+        query, so the index is searched and each data block decompressed once
+        per span rather than once per interval.  Results are identical to
+        calling :meth:`summarize` with `bins=None` on each interval.
+        """
+        bw = self.native_file()
+        results = [None] * len(intervals)
+        order = sorted(
+            range(len(intervals)),
+            key=lambda i: (intervals[i].chrom, intervals[i].start))
+
+        def fill(chrom, start, stop, members):
+            s = bw.get_as_array(chrom, start, stop)
+            if s is None:
+                s = np.zeros((stop - start,))
+            else:
+                s[np.isnan(s)] = 0
+            for i in members:
+                interval = intervals[i]
+                results[i] = s[
+                    interval.start - start:interval.stop - start].copy()
+
+        span = None
+        for i in order:
+            interval = intervals[i]
+            if (
+                span is not None
+                and interval.chrom == span[0]
+                and interval.start <= span[2] + max_gap
+                and max(interval.stop, span[2]) - span[1] <= max_span
+            ):
+                span[2] = max(interval.stop, span[2])
+                span[3].append(i)
+                continue
+            if span is not None:
+                fill(*span)
+            span = [interval.chrom, interval.start, interval.stop, [i]]
+        if span is not None:
+            fill(*span)
+        return results
+
     def __getitem__(self, key):
         raise NotImplementedError(
             "__getitem__ not implemented for %s" % self.__class__.__name__)
 
     def summarize(self, interval, bins=None, method='summarize',
-                  function='mean'):
+                  function='mean', zoom=None, max_error=None):
+        """
+        Summarize the bigWig signal in `interval` into `bins` bins.
+
+        `function` is the statistic reported for each bin, one of "mean",
+        "sum", "min", "max", "std" or "coverage" (the fraction of the bin
+        with data).  It can also be a list of these, in which case all of the
+        statistics are computed from a single query of the file and the
+        result is a 2-D array with one row per statistic, in the order given.
+        Multiple statistics are not supported for method="get_as_array".
+
+        By default bx-python chooses which zoom level to summarize from.  Use
+        `zoom` (in bp) or `max_error` (as a fraction of the bin size) to
+        instead use the coarsest zoom level meeting that resolution, trading
+        precision for speed; see :meth:`zoom_level`.  The reduction level
+        used (0 for the full-resolution data) is stored in
+        `last_zoom_level`.  Only supported for method="summarize".
+        """
+        multiple = isinstance(function, (list, tuple))
+        functions = list(function) if multiple else [function]
+        use_zoom = (zoom is not None) or (max_error is not None)
+        if use_zoom and (
+                bins is None or method in ('get_as_array', 'ucsc_summarize')):
+            raise ValueError(
+                'zoom and max_error are only supported for '
+                'method="summarize" with bins')
 
         # We may be dividing by zero in some cases, which raises a warning in
         # NumPy based on the IEEE 754 standard (see
@@ -168,7 +656,11 @@ class BigWigAdapter(BaseAdapter):
         np.seterr(invalid='ignore')
 
         if (bins is None) or (method == 'get_as_array'):
-            bw = BigWigFile(open(self.fn))
+            if multiple:
+                raise ValueError(
+                    'multiple functions are not supported for '
+                    'method="get_as_array"')
+            bw = self.native_file()
             s = bw.get_as_array(
                 interval.chrom,
                 interval.start,
@@ -179,40 +671,92 @@ class BigWigAdapter(BaseAdapter):
                 s[np.isnan(s)] = 0
 
         elif method == 'ucsc_summarize':
-            if function in ['mean', 'min', 'max', 'std', 'coverage']:
-                return self.ucsc_summarize(interval, bins, function=function)
+            for f in functions:
+                if f not in ['mean', 'min', 'max', 'std', 'coverage']:
+                    raise ValueError('function "%s" not supported by UCSC\'s'
+                                     'bigWigSummary' % f)
+            s = [self.ucsc_summarize(interval, bins, function=f)
+                 for f in functions]
+            if multiple:
+                s = np.vstack(s)
             else:
-                raise ValueError('function "%s" not supported by UCSC\'s'
-                                 'bigWigSummary')
+                s = s[0]
 
         else:
-            bw = BigWigFile(open(self.fn))
-            s = bw.summarize(
-                interval.chrom,
-                interval.start,
-                interval.stop, bins)
-            if s is None:
-                s = np.zeros((bins,))
+            bw = self.bigwig_file()
+            if use_zoom:
+                bin_size = (interval.stop - interval.start) / float(bins)
+                level = self.zoom_level(bin_size, zoom, max_error)
+                self.last_zoom_level = level
+                if level == 0:
+                    summary = bw.summarize_from_full(
+                        interval.chrom,
+                        interval.start,
+                        interval.stop, bins)
+                else:
+                    summary = self._zoom_summary(level, interval, bins)
+            else:
+                summary = bw.summarize(
+                    interval.chrom,
+                    interval.start,
+                    interval.stop, bins)
+            if summary is None:
+                s = np.zeros((len(functions), bins))
             else:
-                if function == 'sum':
-                    s = s.sum_data
-                if function == 'mean':
-                    s = s.sum_data / s.valid_count
-                    s[np.isnan(s)] = 0
-                if function == 'min':
-                    s = s.min_val
-                    s[np.isinf(s)] = 0
-                if function == 'max':
-                    s = s.max_val
-                    s[np.isinf(s)] = 0
-                if function == 'std':
-                    s = (s.sum_squares / s.valid_count)
-                    s[np.isnan(s)] = 0
+                bin_size = (interval.stop - interval.start) / float(bins)
+                s = np.vstack([
+                    _summary_statistic(summary, f, bin_size)
+                    for f in functions])
+            if not multiple:
+                s = s[0]
 
         # Reset NumPy error reporting
-        np.seterr(divide=orig)
+        np.seterr(invalid=orig)
         return s
 
+    def ucsc_summarize_batch(self, intervals, bins, function='mean'):
+        """
+        Equivalent to calling :meth:`ucsc_summarize` on each of `intervals`,
+        but with a single run of bigWigAverageOverBed on all the bins of all
+        the intervals instead of one bigWigSummary process per interval.
+
+        Returns a 2-D array with one row per interval and `bins` columns.
+        `function` is "mean" (the mean over bases with data, as reported by
+        bigWigSummary) or "coverage" (the fraction of bases with data).
+        """
+        if function not in ('mean', 'coverage'):
+            raise ValueError(
+                'function "%s" not supported by bigWigAverageOverBed'
+                % function)
+        y = np.zeros((len(intervals), bins))
+
+        # Split each interval into bins the same way as bigWigSummary, and
+        # name each bin after its position in the flattened output.  Empty
+        # bins (intervals shorter than `bins`) are left as zero.
+        bed = pybedtools.BedTool._tmp()
+        fout = open(bed, 'w')
+        for i, interval in enumerate(intervals):
+            size = interval.stop - interval.start
+            edges = interval.start + (size * np.arange(bins + 1)) // bins
+            for j in range(bins):
+                if edges[j + 1] > edges[j]:
+                    fout.write('%s\t%s\t%s\t%s\n' % (
+                        interval.chrom, edges[j], edges[j + 1],
+                        i * bins + j))
+        fout.close()
+
+        names, values = bigwig_average_over_bed(self.fn, bed)
+        os.unlink(bed)
+        ind = np.array(names, dtype=int)
+        if function == 'mean':
+            col = values[:, average_over_bed_columns.index('mean')]
+        else:
+            col = (
+                values[:, average_over_bed_columns.index('covered')]
+                / values[:, average_over_bed_columns.index('size')])
+        y.flat[ind] = col
+        return y
+
     def ucsc_summarize(self, interval, bins=None, function='mean'):
         if bins is None:
             bins = len(interval)
@@ -258,3 +802,74 @@ class BigWigAdapter(BaseAdapter):
                 except ValueError:
                     pass
         return np.array(y)
+
+
+def _tagged(intervals, i):
+    """
+    Generator of (start, i, interval) for each interval, for merging sorted
+    streams of intervals with heapq.merge().
+    """
+    for interval in intervals:
+        yield interval.start, i, interval
+
+
+class MergedAdapter(BaseAdapter):
+    """
+    Adapter that presents several adapters of the same type (e.g., for the
+    BAM files of replicates) as one, merging their features region by region
+    as they are read.
+
+    If `scale_factors` is not None, it has one number per adapter giving the
+    weight of each feature from that adapter; see :meth:`fetch_arrays`.
+    """
+    def __init__(self, adapters, scale_factors=None):
+        adapters = list(adapters)
+        classes = set(adapter.__class__ for adapter in adapters)
+        if len(classes) != 1:
+            raise ValueError(
+                "Merged adapters must all be of the same type, got %s"
+                % sorted(i.__name__ for i in classes))
+        if scale_factors is None:
+            scale_factors = [1] * len(adapters)
+        if len(scale_factors) != len(adapters):
+            raise ValueError(
+                "scale_factors must have same length as adapters")
+        self.adapters = adapters
+        self.adapter_class = classes.pop()
+        self.scale_factors = np.asarray(scale_factors, dtype=float)
+        super(MergedAdapter, self).__init__(
+            [adapter.fn for adapter in adapters])
+
+    def make_fileobj(self):
+        return None
+
+    def __getitem__(self, key):
+        merged = heapq.merge(
+            *[_tagged(adapter[key], i)
+              for i, adapter in enumerate(self.adapters)])
+        for start, i, interval in merged:
+            yield interval
+
+    def fetch_arrays(self, key, weights=False, **kwargs):
+        """
+        Returns the features of all adapters overlapping the interval `key`
+        as one structured array with :data:`interval_dtype`, sorted by start
+        position.  Additional keyword arguments are passed to the
+        `fetch_arrays` method of each adapter.
+
+        If `weights` is True, then a tuple of (records, weights) is returned,
+        where `weights` holds the scale factor of the adapter each record
+        came from.
+        """
+        parts = [adapter.fetch_arrays(key, **kwargs)
+                 for adapter in self.adapters]
+        records = np.concatenate(parts)
+        # Interleave the adapters' features by start position as
+        # __getitem__ does; the stable sort keeps the order within each
+        # adapter for ties.
+        order = np.argsort(records['start'], kind='mergesort')
+        records = records[order]
+        if weights:
+            return records, np.repeat(
+                self.scale_factors, [len(i) for i in parts])[order]
+        return records
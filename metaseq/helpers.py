@@ -15,6 +15,60 @@ def rebin(x, y, nbin):
     return xi, np.interp(xi, x, y)
 
 
+def rebin_rows(y, nbin):
+    """
+    Vectorized version of :func:`rebin` for a 2-D array in which each row is
+    the un-binned signal of a feature, and all features have the same length.
+
+    Since every row shares the same sampling positions, the interpolation
+    indices and weights are computed once and applied to the whole array.
+    Returns an array of shape (y.shape[0], nbin) with the same values as
+    calling :func:`rebin` on each row.
+    """
+    y = np.asarray(y, dtype=float)
+    size = y.shape[-1]
+    if nbin == size:
+        return y.copy()
+    xi = np.linspace(0, size - 1, nbin)
+    left = np.minimum(np.floor(xi).astype(int), max(size - 2, 0))
+    right = np.minimum(left + 1, size - 1)
+    frac = xi - left
+    return y[..., left] * (1 - frac) + y[..., right] * frac
+
+
+def bin_sums(y, nbin):
+    """
+    Exact sum of the signal in `y` within each of `nbin` equal-width bins
+    spanning the last axis of `y`.
+
+    Bin edges do not need to fall on integer positions: a position that is
+    split by a bin edge contributes to each bin in proportion to its overlap.
+    If `nbin` evenly divides the length of `y` this is a reshape-and-sum;
+    otherwise the sums are differences of a cumulative sum taken at the bin
+    edges.  Works on 1-D arrays or on 2-D arrays of equal-length rows.
+    """
+    y = np.asarray(y, dtype=float)
+    size = y.shape[-1]
+    if size % nbin == 0:
+        return y.reshape(y.shape[:-1] + (nbin, size // nbin)).sum(axis=-1)
+    edges = np.linspace(0, size, nbin + 1)
+    csum = np.zeros(y.shape[:-1] + (size + 1,))
+    np.cumsum(y, axis=-1, out=csum[..., 1:])
+    ind = np.minimum(np.floor(edges).astype(int), size - 1)
+    integral = csum[..., ind] + y[..., ind] * (edges - ind)
+    return np.diff(integral, axis=-1)
+
+
+def bin_centers(start, stop, nbin):
+    """
+    Genomic coordinates of the centers of `nbin` equal-width bins spanning
+    [start, stop), using the same convention as np.arange(start, stop) for
+    single-bp bins.
+    """
+    edges = np.linspace(start, stop, nbin + 1)
+    return (edges[:-1] + edges[1:]) / 2. - 0.5
+
+
 def chunker(f, n):
     """
     Utility function to split iterable `f` into `n` chunks
@@ -1,8 +1,9 @@
 """
 This module integrates parts of metaseq that are useful for ChIP-seq analysis.
 """
+import functools
 import os
-from itertools import izip
+import sys
 import gffutils
 from gffutils.helpers import asinterval
 import metaseq
@@ -43,6 +44,7 @@ def save(c, prefix, relative_paths=True):
 
     :prefix.npz:
         A NumPy .npz file with keys 'diffed_array', 'ip_array', and 'control_array'
+        ('ip_array' and 'control_array' are left out if they were not kept)
 
     """
     dirname = os.path.dirname(prefix)
@@ -65,20 +67,23 @@ def save(c, prefix, relative_paths=True):
             'relative_paths': relative_paths,
         }
         fout.write(yaml.dump(info, default_flow_style=False))
-    np.savez(
-        prefix,
+    arrays = dict(
         diffed_array=c.diffed_array,
         ip_array=c.ip_array,
         control_array=c.control_array
     )
+    np.savez(
+        prefix,
+        **dict((k, v) for k, v in arrays.items() if v is not None))
 
 def load(prefix):
     info = yaml.load(open(prefix + '.info'))
     c = Chipseq(ip_bam=info['ip_bam'], control_bam=info['control_bam'],
                 dbfn=info['dbfn'])
     npz = np.load(prefix + '.npz', mmap_mode='r')
-    c.ip_array = npz['ip_array']
-    c.control_array = npz['control_array']
+    if 'ip_array' in npz.files:
+        c.ip_array = npz['ip_array']
+        c.control_array = npz['control_array']
     c.diffed_array = npz['diffed_array']
     c.array_kwargs = info['array_kwargs']
     c.features = pybedtools.BedTool(prefix + '.intervals')
@@ -164,7 +169,7 @@ class Chipseq(object):
 
 
     def diff_array(self, features, force=True, func=None,
-                   array_kwargs=dict(), cache=None):
+                   array_kwargs=dict(), cache=None, keep_arrays=True):
         """
         Scales the control and IP data to million mapped reads, then subtracts
         scaled control from scaled IP, applies `func(diffed)` to the diffed
@@ -187,6 +192,12 @@ class Chipseq(object):
             `lambda x: x`, or `lambda x: 1e6*x`
         :param force: Force a re-calculation of the arrays; otherwise uses
             cached values
+        :param keep_arrays: If False, then the scaling, subtraction and
+            `func` are applied to each chunk of features as it is created
+            (see the `normalize` and `control` arguments of
+            genomic_signal.array), so only `self.diffed_array` is ever
+            created in full.  `self.ip_array` and `self.control_array` are
+            then set to None.
         """
         self.features = list(features)
         self.browser_local_coverage_kwargs = array_kwargs.copy()
@@ -195,13 +206,21 @@ class Chipseq(object):
 
         self.array_kwargs = array_kwargs.copy()
 
+        if not keep_arrays:
+            self.ip_array = None
+            self.control_array = None
+            self.diffed_array = self.ip.array(
+                self.features, normalize='rpm', control=self.control,
+                transform=func, **array_kwargs)
+            return
+
         if (self.ip_array is None) or force:
-            self.ip_array = self.ip.array(features, **array_kwargs)
-            self.ip_array /= self.ip.mapped_read_count() / 1e6
+            self.ip_array = self.ip.array(
+                self.features, normalize='rpm', **array_kwargs)
 
         if (self.control_array is None) or force:
-            self.control_array = self.control.array(features, **array_kwargs)
-            self.control_array /= self.control.mapped_read_count() / 1e6
+            self.control_array = self.control.array(
+                self.features, normalize='rpm', **array_kwargs)
 
         if func is None:
             #func = metaseq.plotutils.nice_log
@@ -294,6 +313,14 @@ class Chipseq(object):
                 self.minibrowser.plot(feature)
 
 
+def _enough_coverage(row, windowsize, thresh):
+    """
+    True if both strands of `row` (plus, minus) have more than `thresh`
+    average coverage across `windowsize` bp.
+    """
+    return np.all((row.sum(axis=1) / float(windowsize)) > thresh)
+
+
 def estimate_shift(signal, genome=None, windowsize=5000, thresh=None,
                    nwindows=1000, maxlag=500, array_kwargs=None,
                    verbose=False):
@@ -320,8 +347,8 @@ def estimate_shift(signal, genome=None, windowsize=5000, thresh=None,
         correlation can be noisy.
     :param maxlag: Max shift to look for
     :param array_kwargs: Kwargs passed directly to genomic_signal.array, with
-        the default of `bins=windowsize` for single-bp resolution, and
-        `read_strand` will be overwritten.
+        the default of `bins=windowsize` for single-bp resolution.
+        `read_strand` and `split_strands` will be overwritten.
     :param verbose: Be verbose.
 
     Returns lags and a `maxlag*2+1` x `nwindows` matrix of cross-correlations.
@@ -352,6 +379,7 @@ def estimate_shift(signal, genome=None, windowsize=5000, thresh=None,
         array_kwargs = {}
 
     array_kwargs.pop('read_strand', None)
+    array_kwargs.pop('split_strands', None)
 
     if 'bins' not in array_kwargs:
         array_kwargs['bins'] = windowsize
@@ -370,62 +398,75 @@ def estimate_shift(signal, genome=None, windowsize=5000, thresh=None,
         .shuffle(genome=genome).saveas()
 
     if verbose:
-        sys.stderr.write("Getting plus-strand signal for %s regions...\n"
-                         % nwindows)
-        sys.stderr.flush()
-
-    plus = signal.array(
-        features=random_subset,
-        read_strand="+",
-        **array_kwargs).astype(float)
-
-    if verbose:
-        sys.stderr.write("Getting minus-strand signal for %s regions...\n"
-                         % nwindows)
+        sys.stderr.write("Getting plus- and minus-strand signal for %s "
+                         "regions...\n" % nwindows)
         sys.stderr.flush()
 
-    minus = signal.array(
+    # only do cross-correlation if you have enough reads to do so; windows
+    # without enough reads are dropped as they are created.
+    enough, (plus, minus) = signal.array(
         features=random_subset,
-        read_strand="-",
-        **array_kwargs).astype(float)
-
-    # only do cross-correlation if you have enough reads to do so
-    enough = ((plus.sum(axis=1) / windowsize) > thresh) \
-        & ((minus.sum(axis=1) / windowsize) > thresh)
+        split_strands=True,
+        where=functools.partial(_enough_coverage, windowsize=windowsize,
+                                thresh=thresh),
+        **array_kwargs)
 
     if verbose:
         sys.stderr.write(
             "Running cross-correlation on %s regions that passed "
-            "threshold\n" % sum(enough))
-    results = np.zeros((sum(enough), 2 * maxlag + 1))
-    for i, xy in enumerate(izip(plus[enough], minus[enough])):
-        x, y = xy
-        results[i] = xcorr(x, y, maxlag)
+            "threshold\n" % len(enough))
+    results = np.zeros((len(enough), 2 * maxlag + 1))
+    for start in range(0, len(enough), _xcorr_chunksize):
+        stop = start + _xcorr_chunksize
+        results[start:stop] = xcorr(plus[start:stop], minus[start:stop],
+                                    maxlag)
 
     lags = np.arange(-maxlag, maxlag + 1)
 
     return lags, results
 
 
+# Number of rows at a time cross-correlated by estimate_shift
+_xcorr_chunksize = 1000
+
+
 def xcorr(x, y, maxlags):
     """
     Streamlined version of matplotlib's `xcorr`, without the plots.
 
-    :param x, y: NumPy arrays to cross-correlate
+    :param x, y: NumPy arrays to cross-correlate.  If 2-D, then each row of
+        `x` is cross-correlated with the same row of `y`, all at once.
     :param maxlags: Max number of lags; result will be `2*maxlags+1` in length
-    """
-    xlen = len(x)
-    ylen = len(y)
-    assert xlen == ylen
+        (or have `2*maxlags+1` columns for 2-D input)
 
-    c = np.correlate(x, y, mode=2)
+    The cross-correlation is computed with FFTs, zero-padded so that lags up
+    to `maxlags` don't wrap around, which matches np.correlate(x, y, mode=2)
+    over those lags (to within floating-point error) in O(n log n) rather
+    than O(n^2).
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    assert x.shape == y.shape
+    one_d = x.ndim == 1
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    xlen = x.shape[1]
+
+    # next power of 2 that leaves room for `maxlags` of zero-padding
+    nfft = 2 ** int(np.ceil(np.log2(xlen + maxlags)))
+    full = np.fft.irfft(
+        np.fft.rfft(x, nfft, axis=1) * np.conj(np.fft.rfft(y, nfft, axis=1)),
+        nfft, axis=1)
+
+    # lag k is at full[:, k], and negative lags wrap around to the end
+    c = np.concatenate([full[:, nfft - maxlags:], full[:, :maxlags + 1]],
+                       axis=1)
 
     # normalize
-    c /= np.sqrt(np.dot(x, x) * np.dot(y, y))
-
-    lags = np.arange(-maxlags, maxlags + 1)
-    c = c[xlen - 1 - maxlags:xlen + maxlags]
+    c /= np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1))[:, None]
 
+    if one_d:
+        return c[0]
     return c
 
 
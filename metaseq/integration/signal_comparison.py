@@ -6,6 +6,7 @@ import sys
 import pybedtools
 import itertools
 import numpy as np
+from metaseq.helpers import chunker
 
 
 def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
@@ -31,12 +32,14 @@ def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
 
         * Takes `batchsize` features at a time from `features`
 
-        * Constructs normalized (RPMMR) arrays in parallel for each input
-          genomic signal object for those `batchsize` features
-
-        * Applies `comparefunc` (np.subtract by default) to the arrays to get
-          a "compared" (e.g., difference matrix by default) for the `batchsize`
-          features.
+        * Constructs normalized (RPMMR) arrays for each input genomic signal
+          object for those `batchsize` features, and applies `comparefunc`
+          (np.subtract by default) to them to get a "compared" (e.g.,
+          difference matrix by default) array.  This is done by
+          `signal1.array(..., normalize='rpm', control=signal2)`, so the
+          comparison is done as the rows are created (in parallel, if
+          `processes` is in `array_kwargs`) and only the compared array is
+          kept.
 
         * For each row in this matrix, it outputs each nonzero column as
           a bedGraph format line in `outfn`
@@ -53,6 +56,9 @@ def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
         def lfc(x, y):
             return np.log2(x / y)
 
+    When running in parallel, `comparefunc` must be picklable (e.g., defined
+    at the top level of a module rather than a lambda).
+
     :param signal1: A genomic_signal object
     :param signal2: Another genomic_signal object
     :param features: An iterable of pybedtools.Interval objects. A list will be
@@ -67,26 +73,20 @@ def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
         `processes` and `chunksize` if you want parallel processing
     :param verbose: Be noisy
     """
+    if array_kwargs is None:
+        array_kwargs = {}
     fout = open(outfn, 'w')
     fout.write('track type=bedGraph\n')
 
-    i = 0
-    this_batch = []
-    for feature in features:
-        if i <= batchsize:
-            this_batch.append(feature)
-            i += 1
-            continue
-
+    for this_batch in chunker(features, batchsize):
+        this_batch = list(this_batch)
         if verbose:
-            print 'working on batch of %s' % batchsize
+            print 'working on batch of %s' % len(this_batch)
             sys.stdout.flush()
 
-        arr1 = signal1.array(this_batch, **array_kwargs).astype(float)
-        arr2 = signal2.array(this_batch, **array_kwargs).astype(float)
-        arr1 /= signal1.million_mapped_reads()
-        arr2 /= signal2.million_mapped_reads()
-        compared = comparefunc(arr1, arr2)
+        compared = signal1.array(
+            this_batch, normalize='rpm', control=signal2,
+            comparefunc=comparefunc, **array_kwargs)
 
         for feature, row in itertools.izip(this_batch, compared):
             start = feature.start
@@ -95,7 +95,7 @@ def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
 
             # Quickly move on if nothing here.  speed increase prob best for
             # sparse data
-            if sum(row) == 0:
+            if not row.any():
                 continue
 
             for j in range(0, len(row)):
@@ -108,8 +108,6 @@ def compare(signal1, signal2, features, outfn, comparefunc=np.subtract,
                         str(stop),
                         str(score)]) + '\n')
                 start = start + binsize
-        this_batch = []
-        i = 0
     fout.close()
 
 
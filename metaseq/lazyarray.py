@@ -0,0 +1,539 @@
+"""
+Lazy 2-D arrays of genomic signal, as returned by ``signal.array(...,
+lazy=True)``.
+
+A :class:`LazyArray` records the arguments used to create an array and any
+operations done on it (arithmetic, functions applied with
+:meth:`LazyArray.apply`, selecting or re-ordering rows), without creating the
+array.  The array is only created when it is consumed -- by
+:meth:`LazyArray.compute`, ``np.asarray()``, or by functions that need the
+full array such as :func:`metaseq.plotutils.imshow` or
+:func:`metaseq.persistence.save_features_and_arrays` -- and then one chunk of
+rows at a time.
+
+Reductions such as :meth:`LazyArray.mean` are done on each chunk as it is
+created (in the worker processes, if the array was created with
+`processes`), so the full array is never created for them::
+
+    >>> ip = metaseq.genomic_signal(ip_bam, 'bam')
+    >>> control = metaseq.genomic_signal(control_bam, 'bam')
+    >>> diffed = (ip.array(tsses, bins=100, normalize='rpm', lazy=True)
+    ...           - control.array(tsses, bins=100, normalize='rpm', lazy=True))
+    >>> logged = diffed.apply(metaseq.plotutils.nice_log)
+    >>> ind = np.argsort(logged.mean(axis=1))
+    >>> profile = logged[ind[-500:]].mean(axis=0)
+
+Functions given to :meth:`LazyArray.apply` must work on each row
+independently, and must be picklable (e.g., not lambdas) when using
+`processes`.
+
+:meth:`LazyArray.metagene` (or ``signal.array(..., reduce='meanvar')``)
+returns only the column-wise statistics needed for average profiles, as
+a :class:`Metagene`, optionally for each subset of rows, and
+:meth:`LazyArray.top` (or ``signal.top_features()``) keeps only the
+highest-scoring rows of each chunk.
+"""
+import functools
+import multiprocessing
+import operator
+import numpy as np
+from array_helpers import _array, ArgumentError
+
+
+class _Leaf(object):
+    """
+    Rows of an array of genomic signal, created by
+    :func:`metaseq.array_helpers._array`.
+    """
+    def __init__(self, fn, cls, features, kwargs, ncols):
+        self.fn = fn
+        self.cls = cls
+        self.features = features
+        self.kwargs = kwargs
+        self.ncols = ncols
+
+    def take(self, rows):
+        return _Leaf(self.fn, self.cls, [self.features[i] for i in rows],
+                     self.kwargs, self.ncols)
+
+    def evaluate(self):
+        if len(self.features) == 0:
+            return np.zeros((0, self.ncols))
+        return np.row_stack(
+            _array(self.fn, self.cls, self.features, **self.kwargs))
+
+
+class _Rows(object):
+    """
+    A NumPy array with one row per row of a LazyArray, used as an operand.
+    """
+    def __init__(self, arr):
+        self.arr = arr
+
+    def take(self, rows):
+        return _Rows(self.arr[rows])
+
+    def evaluate(self):
+        return self.arr
+
+
+class _Apply(object):
+    """
+    The result of func(*args), where args can include other nodes.
+    """
+    def __init__(self, func, args, kwargs=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+
+    def take(self, rows):
+        return _Apply(
+            self.func,
+            [i.take(rows) if isinstance(i, (_Leaf, _Rows, _Apply)) else i
+             for i in self.args],
+            self.kwargs)
+
+    def evaluate(self):
+        return self.func(
+            *[i.evaluate() if isinstance(i, (_Leaf, _Rows, _Apply)) else i
+              for i in self.args],
+            **self.kwargs)
+
+
+class Metagene(object):
+    """
+    Column-wise statistics of the rows of an array -- the number of rows and
+    the mean and sum of squared deviations from the mean of each column --
+    from which the average profile ("metagene") and its variance can be
+    found without keeping the array.
+
+    Statistics for different sets of rows are combined with `+`, using the
+    pairwise update of Chan et al. so that the variance stays accurate.
+    """
+    def __init__(self, count, mean, m2):
+        self.count = count
+        self._mean = np.asarray(mean, dtype=float)
+        self.m2 = np.asarray(m2, dtype=float)
+
+    @classmethod
+    def from_array(cls, arr):
+        """
+        Metagene for the rows of the 2-D array `arr`.
+        """
+        arr = np.asarray(arr, dtype=float)
+        mean = arr.mean(axis=0)
+        return cls(len(arr), mean, ((arr - mean) ** 2).sum(axis=0))
+
+    def __add__(self, other):
+        if self.count == 0:
+            return other
+        if other.count == 0:
+            return self
+        count = self.count + other.count
+        delta = other._mean - self._mean
+        mean = self._mean + delta * other.count / float(count)
+        m2 = (self.m2 + other.m2
+              + delta ** 2 * self.count * other.count / float(count))
+        return Metagene(count, mean, m2)
+
+    def __repr__(self):
+        return '<Metagene of %s rows x %s columns>' % (
+            self.count, len(self._mean))
+
+    @property
+    def mean(self):
+        """
+        Column-wise mean, i.e., the average profile
+        """
+        return self._mean
+
+    @property
+    def sum(self):
+        """
+        Column-wise sum
+        """
+        return self._mean * self.count
+
+    @property
+    def var(self):
+        """
+        Column-wise (population) variance, as from arr.var(axis=0)
+        """
+        return self.m2 / self.count
+
+    @property
+    def std(self):
+        """
+        Column-wise (population) standard deviation, as from arr.std(axis=0)
+        """
+        return np.sqrt(self.var)
+
+
+def _metagenes(block, labels):
+    """
+    Dictionary of label -> Metagene for the rows of `block` with each of
+    `labels` (one per row), or {None: Metagene} if `labels` is None.
+    """
+    if labels is None:
+        return {None: Metagene.from_array(block)}
+    labels = np.asarray(labels)
+    return dict(
+        (label, Metagene.from_array(block[labels == label]))
+        for label in np.unique(labels))
+
+
+def _row_scores(block, score, weights=None):
+    """
+    One score per row of `block`: its sum, its max, its sum weighted by
+    `weights` (for "tip"), or the result of calling `score` on `block`.
+    """
+    if score == 'sum':
+        return block.sum(axis=1)
+    if score == 'max':
+        return block.max(axis=1)
+    if score == 'tip':
+        return block.dot(weights)
+    return np.asarray(score(block), dtype=float)
+
+
+def _top_rows(block, rows, k, score, weights=None):
+    """
+    (rows, scores, block) for the `k` highest-scoring rows of `block`, whose
+    row numbers are `rows`.  Ties are broken by row number.
+    """
+    scores = _row_scores(block, score, weights)
+    if len(scores) != len(block):
+        raise ValueError(
+            "score function returned %s values for %s rows"
+            % (len(scores), len(block)))
+    keep = np.lexsort((rows, -scores))[:k]
+    return rows[keep], scores[keep], block[keep]
+
+
+def _evaluate_chunk(args):
+    """
+    Evaluates `node` and, if `reduction` is not None, reduces it with the
+    array method named by `reduction` along `axis`.  If `reduction` is
+    a function, it is called with the block and `labels` instead.
+    """
+    node, reduction, axis, labels = args
+    block = node.evaluate()
+    if reduction is None:
+        return block
+    if block.shape[0] == 0:
+        return None
+    if callable(reduction):
+        return reduction(block, labels)
+    return getattr(block, reduction)(axis=axis)
+
+
+# How the partial results of each reduction along axis 0 are combined
+_combine = {
+    'sum': np.sum,
+    'min': np.min,
+    'max': np.max,
+}
+
+
+class LazyArray(object):
+    """
+    A 2-D array of genomic signal that is created one chunk of rows at
+    a time when it is consumed; see the module docstring.
+
+    `processes` is the number of processes used to create the chunks (None
+    to create them in this process), and `chunksize` is the number of rows
+    in each chunk.
+    """
+    # so that arithmetic with a NumPy array on the left stays lazy
+    __array_priority__ = 100
+
+    def __init__(self, node, nrows, ncols, processes=None, chunksize=1000):
+        self.node = node
+        self.nrows = nrows
+        self.ncols = ncols
+        self.processes = processes
+        self.chunksize = chunksize
+
+    @classmethod
+    def from_signal(cls, signal, features, ncols, processes=None,
+                    chunksize=1000, **kwargs):
+        """
+        LazyArray for ``signal.array(features, **kwargs)``, with `ncols`
+        columns.
+        """
+        features = list(features)
+        return cls(
+            _Leaf(signal.fn, signal.__class__, features, kwargs, ncols),
+            len(features), ncols, processes=processes, chunksize=chunksize)
+
+    @property
+    def shape(self):
+        return (self.nrows, self.ncols)
+
+    def __len__(self):
+        return self.nrows
+
+    def __repr__(self):
+        return '<LazyArray shape=%s>' % (self.shape,)
+
+    def _new(self, node, nrows=None):
+        if nrows is None:
+            nrows = self.nrows
+        return LazyArray(node, nrows, self.ncols, processes=self.processes,
+                         chunksize=self.chunksize)
+
+    def _chunks(self):
+        """
+        List of nodes for each chunk of rows
+        """
+        return [
+            self.node.take(np.arange(start, min(start + self.chunksize,
+                                                self.nrows)))
+            for start in range(0, self.nrows, self.chunksize)]
+
+    def _map(self, reduction=None, axis=None, labels=None):
+        """
+        Evaluates each chunk, reducing it if `reduction` is not None, and
+        yields the results in order as they are ready.  `labels` has one
+        item per row, and is split up along with the rows.
+        """
+        tasks = [
+            (node, reduction, axis,
+             None if labels is None
+             else labels[i * self.chunksize:(i + 1) * self.chunksize])
+            for i, node in enumerate(self._chunks())]
+        if self.processes is None:
+            for task in tasks:
+                yield _evaluate_chunk(task)
+            return
+        pool = multiprocessing.Pool(self.processes)
+        try:
+            for result in pool.imap(_evaluate_chunk, tasks):
+                yield result
+        finally:
+            pool.close()
+            pool.join()
+
+    def compute(self):
+        """
+        Creates the array, returning a NumPy array.
+        """
+        out = np.empty(self.shape)
+        start = 0
+        for block in self._map():
+            out[start:start + len(block)] = block
+            start += len(block)
+        return out
+
+    def __array__(self, dtype=None):
+        out = self.compute()
+        if dtype is not None:
+            out = out.astype(dtype)
+        return out
+
+    def _reduce(self, reduction, axis):
+        if axis == 1:
+            parts = self._map(reduction, axis=1)
+            return np.concatenate(
+                [i for i in parts if i is not None] + [np.zeros(0)])
+        if axis not in (0, None):
+            raise ArgumentError("axis must be 0, 1 or None")
+        parts = [i for i in self._map(reduction, axis=0) if i is not None]
+        if len(parts) == 0:
+            raise ValueError("cannot reduce an array with no rows")
+        result = _combine[reduction](parts, axis=0)
+        if axis is None:
+            result = getattr(result, reduction)()
+        return result
+
+    def sum(self, axis=None):
+        """
+        Sum along `axis` (0, 1 or None), computed for each chunk as it is
+        created.
+        """
+        return self._reduce('sum', axis)
+
+    def mean(self, axis=None):
+        """
+        Mean along `axis` (0, 1 or None), computed for each chunk as it is
+        created.
+        """
+        if axis == 1:
+            return self._reduce('mean', axis)
+        total = self._reduce('sum', axis)
+        if axis == 0:
+            return total / float(self.nrows)
+        return total / float(self.nrows * self.ncols)
+
+    def min(self, axis=None):
+        """
+        Minimum along `axis` (0, 1 or None), computed for each chunk as it is
+        created.
+        """
+        return self._reduce('min', axis)
+
+    def max(self, axis=None):
+        """
+        Maximum along `axis` (0, 1 or None), computed for each chunk as it is
+        created.
+        """
+        return self._reduce('max', axis)
+
+    def metagene(self, subset_by=None):
+        """
+        Returns a :class:`Metagene` of the column-wise statistics of the
+        array, computed for each chunk as it is created so that only these
+        statistics are kept (and, with `processes`, sent back by the
+        workers).
+
+        If `subset_by` is not None, it has one label per row, and
+        a dictionary of label -> Metagene for the rows with each label is
+        returned instead.
+        """
+        if subset_by is not None:
+            subset_by = np.asarray(subset_by)
+            if len(subset_by) != self.nrows:
+                raise ArgumentError(
+                    "subset_by must have one item per row, got %s for %s "
+                    "rows" % (len(subset_by), self.nrows))
+        result = {}
+        for part in self._map(_metagenes, labels=subset_by):
+            if part is None:
+                continue
+            for label, metagene in part.items():
+                if label in result:
+                    result[label] = result[label] + metagene
+                else:
+                    result[label] = metagene
+        if subset_by is None:
+            return result.get(
+                None, Metagene(0, np.zeros(self.ncols), np.zeros(self.ncols)))
+        return result
+
+    def top(self, k, score='sum'):
+        """
+        Returns (indices, rows) for the `k` rows with the highest scores, in
+        order of decreasing score, where `rows` is a NumPy array and
+        `indices` are their row numbers in this array.
+
+        Each chunk is reduced to its own top `k` rows as it is created (by
+        the workers, if using `processes`), and these are merged into
+        a running top `k`, so at most a few times `k` rows are kept at once.
+
+        `score` is one of:
+
+            "sum", "max"
+                total or maximum signal in each row
+
+            "tip"
+                sum of each row weighted by the average profile, which ranks
+                rows the same way as :func:`metaseq.plotutils.tip_zscores`.
+                The average profile is found in a first pass over the array,
+                so the array is created twice.
+
+            function
+                called on a 2-D chunk of rows and returns one score per row
+                (must be picklable when using `processes`)
+        """
+        if score not in ('sum', 'max', 'tip') and not callable(score):
+            raise ArgumentError(
+                "score must be 'sum', 'max', 'tip' or a function, got %r"
+                % (score,))
+        weights = None
+        if score == 'tip':
+            weights = self.mean(axis=0)
+        reduction = functools.partial(
+            _top_rows, k=k, score=score, weights=weights)
+        indices = np.zeros(0, dtype=int)
+        scores = np.zeros(0)
+        rows = np.zeros((0, self.ncols))
+        for part in self._map(reduction, labels=np.arange(self.nrows)):
+            if part is None:
+                continue
+            keep = np.lexsort((
+                np.concatenate([indices, part[0]]),
+                -np.concatenate([scores, part[1]])))[:k]
+            indices = np.concatenate([indices, part[0]])[keep]
+            scores = np.concatenate([scores, part[1]])[keep]
+            rows = np.concatenate([rows, part[2]])[keep]
+        return indices, rows
+
+    def apply(self, func, *args, **kwargs):
+        """
+        Returns a new LazyArray of func(array, *args, **kwargs).  `func` is
+        called on chunks of rows, so it must work on each row independently
+        and keep the shape of its input.  Other LazyArrays in `args`, and
+        2-D NumPy arrays with one row per row, are split up into the same
+        rows.
+        """
+        args = [self.node] + [self._operand(i) for i in args]
+        return self._new(_Apply(func, args, kwargs))
+
+    def _operand(self, other):
+        if isinstance(other, LazyArray):
+            if other.nrows != self.nrows:
+                raise ArgumentError(
+                    "LazyArrays must have the same number of rows, got %s "
+                    "and %s" % (self.nrows, other.nrows))
+            return other.node
+        if isinstance(other, np.ndarray) and other.ndim == 2:
+            # one row per row is split up with the chunks; a single row is
+            # broadcast to all of them
+            if other.shape[0] == self.nrows:
+                return _Rows(other)
+            if other.shape[0] != 1:
+                raise ArgumentError(
+                    "2-D arrays must have one row or the same number of "
+                    "rows as the LazyArray, got %s for %s rows"
+                    % (other.shape[0], self.nrows))
+        return other
+
+    def _binary(self, op, other, reflected=False):
+        other = self._operand(other)
+        if reflected:
+            return self._new(_Apply(op, [other, self.node]))
+        return self._new(_Apply(op, [self.node, other]))
+
+    def __add__(self, other):
+        return self._binary(operator.add, other)
+
+    def __radd__(self, other):
+        return self._binary(operator.add, other, reflected=True)
+
+    def __sub__(self, other):
+        return self._binary(operator.sub, other)
+
+    def __rsub__(self, other):
+        return self._binary(operator.sub, other, reflected=True)
+
+    def __mul__(self, other):
+        return self._binary(operator.mul, other)
+
+    def __rmul__(self, other):
+        return self._binary(operator.mul, other, reflected=True)
+
+    def __div__(self, other):
+        return self._binary(operator.truediv, other)
+
+    def __rdiv__(self, other):
+        return self._binary(operator.truediv, other, reflected=True)
+
+    __truediv__ = __div__
+    __rtruediv__ = __rdiv__
+
+    def __neg__(self):
+        return self._new(_Apply(operator.neg, [self.node]))
+
+    def __getitem__(self, rows):
+        """
+        Selects or re-orders rows, e.g., lazy[np.argsort(scores)], returning
+        a new LazyArray.  An integer returns that row as a NumPy array.
+        """
+        if isinstance(rows, tuple):
+            raise ArgumentError("LazyArrays can only be indexed by rows")
+        if isinstance(rows, (int, np.integer)):
+            if rows < 0:
+                rows += self.nrows
+            return self.node.take([rows]).evaluate()[0]
+        rows = np.arange(self.nrows)[rows]
+        return self._new(self.node.take(rows), nrows=len(rows))
@@ -44,7 +44,8 @@ def save_features_and_arrays(features, arrays, prefix, compressed=False,
     ----------
     arrays : dict of NumPy arrays
         Rows in each array should correspond to `features`.  This dictionary is
-        passed to np.savez
+        passed to np.savez, which creates any
+        :class:`metaseq.lazyarray.LazyArray` values.
 
     features : iterable of Feature-like objects
         This is usually the same features that were used to create the array in
@@ -10,6 +10,7 @@ from matplotlib.ticker import MaxNLocator
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib import gridspec
 import colormap_adjust
+from lazyarray import Metagene
 from scipy import stats
 
 
@@ -22,8 +23,9 @@ def ci_plot(x, arr, conf=0.95, ax=None, line_kwargs=None, fill_kwargs=None):
     x : 1-D array-like
         x values for the plot
 
-    arr : 2-D array-like
-        The array to calculate mean and std for
+    arr : 2-D array-like or metaseq.lazyarray.Metagene
+        The array to calculate mean and std for, or its statistics as
+        returned by ``signal.array(..., reduce='meanvar')``
 
     conf : float [.5 - 1]
         Confidence interval to use
@@ -62,6 +64,8 @@ def imshow(arr, x=None, y=None, ax=None, vmin=None, vmax=None, percentile=True,
     Parameters
     ----------
     arr : array-like
+        Can also be a :class:`metaseq.lazyarray.LazyArray`, which is created
+        here.
 
     x : 1D array
         X values to use.  If None, use range(arr.shape[1])
@@ -132,6 +136,7 @@ def imshow(arr, x=None, y=None, ax=None, vmin=None, vmax=None, percentile=True,
         plotted in order starting at the bottom of the heatmap.
 
     """
+    arr = np.asanyarray(arr)
     if ax is None:
         fig = new_shell(
             figsize=figsize,
@@ -349,7 +354,8 @@ def ci(arr, conf=0.95):
 
     Parameters
     ----------
-    arr : array-like
+    arr : array-like or metaseq.lazyarray.Metagene
+        If a Metagene, its stored column-wise statistics are used.
 
     conf : float
         Confidence interval
@@ -363,9 +369,13 @@ def ci(arr, conf=0.95):
     upper : array
         upper column-wise confidence bound
     """
-    m = arr.mean(axis=0)
-    n = len(arr)
-    se = arr.std(axis=0) / np.sqrt(n)
+    if isinstance(arr, Metagene):
+        m, n, std = arr.mean, arr.count, arr.std
+    else:
+        m = arr.mean(axis=0)
+        n = len(arr)
+        std = arr.std(axis=0)
+    se = std / np.sqrt(n)
     h = se * stats.t._ppf((1 + conf) / 2., n - 1)
     return m, m - h, m + h
 
@@ -344,6 +344,349 @@ def test_array_binned_preserve_total():
                 yield check, kind, coord, processes, expected
 
 
+def test_rebin_rows():
+    y = np.random.RandomState(0).poisson(2, size=(5, 37)).astype(float)
+    x = np.arange(100, 137)
+    for nbin in [1, 5, 10, 37, 50]:
+        expected = np.row_stack([metaseq.helpers.rebin(x, i, nbin)[1] for i in y])
+        assert np.allclose(metaseq.helpers.rebin_rows(y, nbin), expected), nbin
+
+
+def test_array_batched():
+    """
+    equal-length features are binned all at once; make sure that gives the
+    same results as binning each feature separately.
+    """
+    def check(kind, kwargs):
+        if kind == 'bigwig':
+            kwargs = dict(kwargs, method='get_as_array')
+        features = ['chr2L:1-20', 'chr2L:61-80[-]', 'chr2L:135-154[+]']
+        try:
+            result = gs[kind].array(features, bins=8, **kwargs)
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        expected = np.row_stack(
+            [gs[kind].local_coverage(i, bins=8, **kwargs)[1]
+             for i in features])
+        assert np.allclose(result, expected), (kind, kwargs, result, expected)
+
+    for kind in ['bam', 'bigbed', 'bed', 'bigwig']:
+        for kwargs in (
+            dict(),
+            dict(accumulate=False),
+            dict(stranded=False),
+            dict(method='exact'),
+            dict(method='mean_offset_coverage'),
+            dict(method='bin_covered'),
+        ):
+            yield check, kind, kwargs
+    for kind in ['bam', 'bigbed', 'bed']:
+        yield check, kind, dict(preserve_total=True)
+        yield check, kind, dict(fragment_size=5)
+        yield check, kind, dict(method='exact', preserve_total=True)
+
+
+def test_fetch_arrays():
+    """
+    fetch_arrays should match iterating over the adapter
+    """
+    def check(kind, coord):
+        adapter = gs[kind].adapter
+        interval = metaseq.helpers.tointerval(coord)
+        try:
+            expected = list(adapter[interval])
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        records = adapter.fetch_arrays(interval)
+        assert records.dtype == metaseq.filetype_adapters.interval_dtype
+        assert list(records['start']) == [i.start for i in expected]
+        assert list(records['stop']) == [i.stop for i in expected]
+        assert list(records['strand']) == [i.strand for i in expected]
+
+    for kind in ['bam', 'bigbed', 'bed']:
+        for coord in ['chr2L:1-200', 'chr2L:71-72', 'chr2L:500-600']:
+            yield check, kind, coord
+
+
+def test_add_coverage():
+    """
+    vectorized coverage should match adding each interval in turn
+    """
+    from metaseq.array_helpers import _add_coverage
+
+    def check(accumulate, preserve_total, use_score):
+        rng = np.random.RandomState(0)
+        start_inds = rng.randint(0, 50, 40)
+        stop_inds = start_inds + rng.randint(-2, 20, 40)
+        stop_inds = np.minimum(stop_inds, 50)
+        if use_score:
+            scores = rng.randint(1, 5, 40).astype(float)
+        else:
+            scores = np.ones(40)
+        result = np.zeros(50)
+        _add_coverage(result, start_inds, stop_inds, scores,
+                      accumulate=accumulate, preserve_total=preserve_total)
+        expected = np.zeros(50)
+        for i, j, score in zip(start_inds, stop_inds, scores):
+            if j <= i:
+                continue
+            if not accumulate:
+                expected[i:j] = score
+            elif preserve_total:
+                expected[i:j] += score / float(j - i)
+            else:
+                expected[i:j] += score
+        assert np.allclose(result, expected), (result, expected)
+        assert np.all((result == 0) == (expected == 0))
+
+    for accumulate in (True, False):
+        for preserve_total in (True, False):
+            for use_score in (True, False):
+                yield check, accumulate, preserve_total, use_score
+
+
+def test_bbi_overlapping_blocks():
+    """
+    blocks found by binary search should match checking every block
+    """
+    f = metaseq.bbi.BigWigFile(metaseq.example_filename('gdc.bigwig'))
+    rng = np.random.RandomState(9)
+    n = 500
+    blocks = np.zeros(n, dtype=f.blocks.dtype)
+    blocks['start_chrom'] = np.sort(rng.randint(0, 3, n))
+    blocks['start_base'] = rng.randint(0, 10000, n)
+    lengths = rng.randint(1, 2000, n)
+    blocks['end_base'] = (blocks['start_base'] + lengths) % 10000
+    # some blocks end on the next chromosome
+    blocks['end_chrom'] = blocks['start_chrom'] + (
+        blocks['start_base'] + lengths >= 10000)
+    blocks['offset'] = np.arange(n)
+    f.blocks = blocks[np.lexsort((blocks['start_base'],
+                                  blocks['start_chrom']))]
+    f._index_blocks()
+
+    b = f.blocks
+    for i in range(200):
+        chrom_id = rng.randint(0, 4)
+        start = rng.randint(0, 10000)
+        end = start + rng.randint(1, 3000)
+        mask = (
+            ((b['start_chrom'] < chrom_id)
+             | ((b['start_chrom'] == chrom_id) & (b['start_base'] < end)))
+            & ((b['end_chrom'] > chrom_id)
+               | ((b['end_chrom'] == chrom_id) & (b['end_base'] > start))))
+        result = f._overlapping_blocks(chrom_id, start, end)
+        assert list(result['offset']) == list(b[mask]['offset'])
+
+
+def test_bbi_native_reader():
+    """
+    the native bigWig/bigBed reader should give the same results as
+    bx-python
+    """
+    from bx.bbi.bigwig_file import BigWigFile
+    from bx.bbi.bigbed_file import BigBedFile
+
+    def check_bigwig(fn, chrom, start, end):
+        result = metaseq.bbi.BigWigFile(fn).get_as_array(chrom, start, end)
+        expected = BigWigFile(open(fn)).get_as_array(chrom, start, end)
+        if expected is None:
+            assert result is None
+            return
+        assert np.array_equal(np.isnan(result), np.isnan(expected))
+        assert np.array_equal(np.nan_to_num(result), np.nan_to_num(expected))
+
+    def check_bigbed(fn, chrom, start, end):
+        result = metaseq.bbi.BigBedFile(fn).get(chrom, start, end)
+        expected = BigBedFile(open(fn)).get(chrom, start, end)
+        if expected is None:
+            assert result is None
+            return
+        expected = [
+            (int(i.fields[1]), int(i.fields[2]), '\t'.join(i.fields[3:]))
+            for i in expected]
+        assert result == expected, (result, expected)
+
+    regions = [
+        ('chr2L', 0, 200),
+        ('chr2L', 65, 80),
+        ('chr2L', 0, 1000000),
+        ('chr2L', 123456, 223456),
+        ('chrX', 0, 100),
+    ]
+    for prefix in ['gdc', 'x']:
+        for region in regions:
+            yield (check_bigwig, metaseq.example_filename(prefix + '.bigwig')) \
+                + region
+            yield (check_bigbed, metaseq.example_filename(prefix + '.bigbed')) \
+                + region
+
+
+def test_bigwig_get_as_arrays():
+    """
+    reading nearby bigWig features together should give the same signal as
+    reading each one separately
+    """
+    def check(kwargs):
+        adapter = gs['bigwig'].adapter
+        features = [metaseq.helpers.tointerval(i) for i in (
+            'chr2L:61-80', 'chr2L:1-20', 'chr2L:11-40', 'chr2L:135-154',
+            'chr2L:5001-5100', 'chr2R:1-20')]
+        result = adapter.get_as_arrays(features, **kwargs)
+        for feature, y in zip(features, result):
+            expected = adapter.summarize(feature, bins=None)
+            assert np.all(y == expected), (feature, y, expected)
+
+    for kwargs in (dict(), dict(max_gap=0), dict(max_span=30)):
+        yield check, kwargs
+
+
+def test_bigwig_zoom():
+    """
+    summarizing from an explicitly chosen zoom level should match bx-python's
+    own choice when the two agree
+    """
+    adapter = gs['bigwig'].adapter
+    levels = adapter.zoom_levels()
+    assert adapter.zoom_level(1000, zoom=levels[0] - 1) == 0
+    assert adapter.zoom_level(1000, zoom=levels[0]) == levels[0]
+    assert adapter.zoom_level(100 * levels[0], max_error=0.01) == levels[0]
+
+    def check(coord, bins, function):
+        interval = metaseq.helpers.tointerval(coord)
+        # bx-python uses the coarsest level up to half the bin size
+        zoom = (interval.stop - interval.start) / bins / 2
+        expected = adapter.summarize(interval, bins=bins, function=function)
+        result = adapter.summarize(
+            interval, bins=bins, function=function, zoom=zoom)
+        assert adapter.last_zoom_level == adapter.zoom_level(None, zoom=zoom)
+        assert np.allclose(result, expected, rtol=1e-4), (result, expected)
+
+    for coord, bins in (('chr2L:1-20', 4), ('chr2L:1-5000', 10)):
+        for function in ('mean', 'sum', 'coverage'):
+            yield check, coord, bins, function
+
+    def check_error(kind, kwargs):
+        assert_raises(
+            ArgumentError, gs[kind].local_coverage, 'chr2L:1-20', bins=4,
+            **kwargs)
+
+    yield check_error, 'bam', dict(zoom=128)
+    yield check_error, 'bigwig', dict(zoom=128, method='get_as_array')
+    yield check_error, 'bigwig', dict(max_error=0.1, method='ucsc_summarize')
+
+    # the same when equal-length features are binned in a batch
+    for kwargs in [dict(zoom=128, method='get_as_array'),
+                   dict(max_error=0.1, method='exact')]:
+        assert_raises(ArgumentError, gs['bigwig'].array,
+                      ['chr2L:1-20', 'chr2L:21-40'], bins=4, **kwargs)
+
+
+def test_exact_binning():
+    def check(kind, coord, bins, kwargs, expected):
+        try:
+            x, y = gs[kind].local_coverage(coord, bins=bins, method='exact', **kwargs)
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        assert np.allclose(y, expected), (kind, coord, bins, y, expected)
+        assert len(x) == bins
+
+    for kind in ['bam', 'bigbed', 'bed', 'bigwig']:
+        for coord, bins, kwargs, expected in (
+            ('chr2L:1-20', 19, {},
+             [0., 0., 0., 0., 0., 0., 0., 0., 0., 1., 1., 1., 1., 1., 0., 0., 0., 0., 0.]),
+            ('chr2L:1-20', 1, {}, [5 / 19.]),
+            # bin edge falls in the middle of the first covered position
+            ('chr2L:1-20', 2, {}, [0.5 / 9.5, 4.5 / 9.5]),
+            ('chr2L:1-20[-]', 2, {}, [4.5 / 9.5, 0.5 / 9.5]),
+            ('chr2L:1-20', 2, dict(accumulate=False), [1., 1.]),
+        ):
+            yield check, kind, coord, bins, kwargs, expected
+
+    for kind in ['bam', 'bigbed', 'bed']:
+        yield check, kind, 'chr2L:1-20', 2, dict(preserve_total=True), [0.5 / 5, 4.5 / 5]
+
+
+def test_multi_array():
+    kinds = ['bam', 'bigbed', 'bigwig']
+    features = ['chr2L:1-20', 'chr2L:1-20[-]', 'chr2L:68-76', 'chr2L:61-80']
+    kwargs = dict(bins=8, method='get_as_array')
+    # read filters given when creating a signal must be kept
+    filtered = metaseq.genomic_signal(gs['bam'].fn, 'bam', exclude_flags=0x10)
+    assert (filtered.array(features, **kwargs)
+            != gs['bam'].array(features, **kwargs)).any()
+    signals = [gs[kind] for kind in kinds] + [filtered]
+
+    def check(processes, scale_factors):
+        try:
+            result = metaseq.multi_array(
+                signals, features, processes=processes, chunksize=3,
+                scale_factors=scale_factors, **kwargs)
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        assert result.shape == (4, 4, 8)
+        for i, signal in enumerate(signals):
+            expected = signal.array(features, **kwargs)
+            if scale_factors is not None:
+                expected *= scale_factors[i]
+            assert np.allclose(result[i], expected), (i, result[i], expected)
+
+    for processes in [None, PROCESSES]:
+        for scale_factors in [None, [1., 0.5, 10., 2.]]:
+            yield check, processes, scale_factors
+
+    assert_raises(ArgumentError, metaseq.multi_array, signals, features)
+    assert_raises(ArgumentError, metaseq.multi_array,
+                  [gs['bigwig'], gs['bam']], features, bins=4, target_reads=10)
+
+    # target_reads becomes a subsample of each BAM signal
+    bams = [gs['bam'], filtered]
+    for processes in [None, PROCESSES]:
+        result = metaseq.multi_array(bams, features, bins=8, target_reads=5,
+                                     processes=processes)
+        for i, signal in enumerate(bams):
+            assert np.allclose(
+                result[i], signal.array(features, bins=8, target_reads=5))
+
+
+def test_split_strands():
+    def check_local_coverage(kind, coord, kwargs):
+        try:
+            x, y = gs[kind].local_coverage(coord, split_strands=True, **kwargs)
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        for i, read_strand in enumerate('+-'):
+            x0, y0 = gs[kind].local_coverage(coord, read_strand=read_strand, **kwargs)
+            assert np.allclose(x, x0)
+            assert np.allclose(y[i], y0), (kind, coord, kwargs, read_strand, y[i], y0)
+
+    def check_array(kind, processes, kwargs):
+        features = ['chr2L:1-20', 'chr2L:61-80[-]', 'chr2L:60-90']
+        try:
+            result = gs[kind].array(
+                features, split_strands=True, processes=processes, **kwargs)
+        except NotImplementedError:
+            raise SkipTest("Incompatible bx-python version for bigBed")
+        assert result.shape[:2] == (2, 3)
+        for i, read_strand in enumerate('+-'):
+            expected = gs[kind].array(features, read_strand=read_strand, **kwargs)
+            assert np.allclose(result[i], expected), (kind, kwargs, read_strand)
+
+    for kind in ['bam', 'bigbed', 'bed']:
+        for coord in ['chr2L:1-20', 'chr2L:68-76[-]', ['chr2L:1-20', 'chr2L:68-76']]:
+            yield check_local_coverage, kind, coord, dict()
+            yield check_local_coverage, kind, coord, dict(fragment_size=5)
+        yield check_local_coverage, kind, 'chr2L:1-20', dict(bins=8)
+        yield check_local_coverage, kind, 'chr2L:60-90', dict(bins=8, preserve_total=True)
+        yield check_local_coverage, kind, 'chr2L:1-20', dict(bins=8, method='exact')
+        for processes in [None, PROCESSES]:
+            yield check_array, kind, processes, dict(bins=8)
+            yield check_array, kind, processes, dict(bins=[8])
+
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, 'chr2L:1-20', split_strands=True)
+    assert_raises(ArgumentError, gs['bam'].local_coverage, 'chr2L:1-20', split_strands=True, read_strand='+')
+
+
 def test_invalid_arguments():
     def check(kind, kw):
         assert_raises(ArgumentError, gs[kind].array, **kw)
@@ -442,6 +785,60 @@ def test_bigwig_methods():
     assert np.allclose(y0, y)
 
 
+def test_bigwig_ucsc_summarize_batch():
+    """
+    all features summarized with one bigWigAverageOverBed run should match
+    running bigWigSummary on each one
+    """
+    def check(function):
+        features = ['chr2L:1-20', 'chr2L:61-80[-]', 'chr2L:1-100', 'chr2L:5-9']
+        result = gs['bigwig'].array(
+            features, bins=8, method='ucsc_summarize', function=function)
+        expected = np.row_stack(
+            [gs['bigwig'].local_coverage(
+                i, bins=8, method='ucsc_summarize', function=function)[1]
+             for i in features])
+        assert np.allclose(result, expected), (function, result, expected)
+
+    for function in ('mean', 'coverage'):
+        yield check, function
+
+
+def test_bigwig_multiple_functions():
+    functions = ['mean', 'sum', 'min', 'max', 'coverage']
+
+    def check_local_coverage(coord, bins):
+        x, y = gs['bigwig'].local_coverage(coord, bins=bins, function=functions)
+        assert y.shape == (len(functions), bins)
+        for i, function in enumerate(functions):
+            x0, y0 = gs['bigwig'].local_coverage(coord, bins=bins, function=function)
+            assert np.allclose(x, x0)
+            assert np.allclose(y[i], y0), (coord, function, y[i], y0)
+
+    def check_array(processes):
+        features = ['chr2L:1-20', 'chr2L:1-20[-]', 'chr2L:60-90']
+        result = gs['bigwig'].array(
+            features, bins=5, function=functions, processes=processes)
+        assert sorted(result.keys()) == sorted(functions)
+        for function in functions:
+            expected = gs['bigwig'].array(features, bins=5, function=function)
+            assert np.allclose(result[function], expected), function
+
+    for coord in ['chr2L:1-20', 'chr2L:60-90[-]', 'chr1:1-100']:
+        yield check_local_coverage, coord, 5
+    for processes in [None, PROCESSES]:
+        yield check_array, processes
+
+    x, y = gs['bigwig'].local_coverage('chr2L:60-90', bins=6, function='coverage')
+    assert np.allclose(y, [0., 0., 1., 0., 0., 0.]), y
+    assert_raises(ArgumentError, gs['bam'].local_coverage, 'chr2L:1-20', function='max')
+    assert_raises(ValueError, gs['bigwig'].local_coverage, 'chr2L:1-20', bins=5,
+                  method='get_as_array', function=functions)
+    # equal-length features are binned in a batch, which should also refuse
+    assert_raises(ValueError, gs['bigwig'].array, ['chr2L:1-20', 'chr2L:21-40'],
+                  bins=5, method='get_as_array', function=functions)
+
+
 def test_coverage_methods():
     location = 'chr2L:135-170'
     nbins = 5  # or try 3
@@ -610,12 +1007,692 @@ def test_supported_formats():
 def test_bam_genome():
     assert gs['bam'].genome() == {'chr2L': (0, 23011544L)}
 
+def test_bam_read_filters():
+    features = ['chr2L:1-20', 'chr2L:61-80', 'chr2L:135-174']
+
+    def check(filters, expected_kwargs, signal_filters=None):
+        result = gs['bam'].local_coverage(features[1], **filters)[1]
+        expected = gs['bam'].local_coverage(features[1], **expected_kwargs)[1]
+        assert np.all(result == expected), (filters, result, expected)
+
+        # filters given when creating the signal are used by default, also
+        # in other processes
+        signal = metaseq.genomic_signal(gs['bam'].fn, 'bam', **filters)
+        for kwargs in (dict(), dict(processes=2)):
+            result = signal.array(features, bins=10, **kwargs)
+            expected = gs['bam'].array(features, bins=10, **expected_kwargs)
+            assert np.allclose(result, expected), (filters, result, expected)
+
+        counts = [signal.local_count(i) for i in features]
+        expected = [
+            gs['bam'].local_count(i, **filters) for i in features]
+        assert counts == expected, (counts, expected)
+
+    yield check, dict(exclude_flags=0x10), dict(read_strand='+')
+    yield check, dict(require_flags=0x10), dict(read_strand='-')
+    yield check, dict(min_mapq=255), dict()
+    yield check, dict(min_mapq=256), dict(read_strand='x')
+
+    assert gs['bam'].local_count(features[1], exclude_flags=0x10) == 1
+    assert gs['bam'].local_count(features[1]) == 2
+
+    def check_error(kind):
+        assert_raises(ArgumentError, gs[kind].local_coverage, features[0],
+                      min_mapq=10)
+
+    for kind in ['bigbed', 'bigwig']:
+        yield check_error, kind
+
+
+def _write_bam(reads):
+    """
+    Writes `reads`, a list of (name, pos, flag, mate pos, tlen, cigar, tags)
+    tuples sorted by position, to a BAM file in a temp dir and returns its
+    filename
+    """
+    import os
+    import tempfile
+    import pysam
+    fn = os.path.join(tempfile.mkdtemp(), 'test.bam')
+    header = {'HD': {'VN': '1.0', 'SO': 'coordinate'},
+              'SQ': [{'LN': 10000, 'SN': 'chr2L'}]}
+    out = pysam.AlignmentFile(fn, 'wb', header=header)
+    for name, pos, flag, mpos, tlen, cigar, tags in reads:
+        a = pysam.AlignedSegment()
+        a.query_name = name
+        a.query_sequence = 'A' * sum(
+            bp for op, bp in cigar if op in (0, 1, 4))
+        a.flag = flag
+        a.reference_id = 0
+        a.reference_start = pos
+        a.mapping_quality = 30
+        a.cigartuples = cigar
+        a.next_reference_id = 0
+        a.next_reference_start = mpos
+        a.template_length = tlen
+        a.tags = tags
+        out.write(a)
+    out.close()
+    pysam.index(fn)
+    return fn
+
+
+def _random_bam_signal(seed, n, span=5000, read_length=30):
+    """
+    BamSignal for `n` reads of `read_length` bp at random positions in
+    chr2L:0-`span` (seeded with `seed`), alternating between the plus and
+    minus strands.
+    """
+    rng = np.random.RandomState(seed)
+    positions = np.sort(rng.randint(0, span, n))
+    return metaseq.genomic_signal(_write_bam([
+        ('r%s' % i, pos, 16 * (i % 2), -1, 0, [(0, read_length)], [])
+        for i, pos in enumerate(positions)]), 'bam')
+
+
+def _paired_bam():
+    """
+    Writes a small paired-end BAM file and returns its filename
+    """
+    # (name, pos, flag, mate pos, tlen); pairs "a" and "b" are proper pairs,
+    # "c" is not properly paired and "d" is longer than max_fragment_size.
+    reads = [
+        ('a', 100, 99, 250, 170),
+        ('a', 250, 147, 100, -170),
+        ('b', 300, 163, 400, 120),
+        ('b', 400, 83, 300, -120),
+        ('c', 450, 65, 480, 50),
+        ('c', 480, 129, 450, -50),
+        ('d', 500, 99, 1980, 1500),
+        ('d', 1980, 147, 500, -1500),
+    ]
+    return _write_bam([read + ([(0, 20)], []) for read in reads])
+
+
+def test_paired_fragments():
+    signal = metaseq.genomic_signal(_paired_bam(), 'bam')
+
+    def check(coord, kwargs, expected):
+        x, y = signal.local_coverage(
+            coord, paired_fragments=True, max_fragment_size=1000, **kwargs)
+        expected = np.array(expected, dtype=float)
+        assert np.all(y == expected), (coord, kwargs, y, expected)
+
+    fragments = np.zeros((2, 600))
+    fragments[0, 100:270] = 1
+    fragments[1, 300:420] = 1
+
+    # "chr2L:1-600" spans positions 1 through 599
+    yield check, 'chr2L:1-600', dict(), fragments.sum(axis=0)[1:]
+    yield check, 'chr2L:1-600', dict(split_strands=True), fragments[:, 1:]
+    yield check, 'chr2L:1-600', dict(read_strand='-'), fragments[1, 1:]
+
+    # straddling the window edges, with the first mate of "b" outside the
+    # window
+    yield check, 'chr2L:261-320', dict(), fragments.sum(axis=0)[261:320]
+
+    assert_raises(ArgumentError, signal.local_coverage, 'chr2L:1-600',
+                  paired_fragments=True, fragment_size=100)
+    assert_raises(ArgumentError, gs['bigbed'].local_coverage, 'chr2L:1-600',
+                  paired_fragments=True)
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, 'chr2L:1-600',
+                  paired_fragments=True)
+
+
+def test_junctions():
+    # (name, pos, flag, cigar, tags); "a" and "b" share the 110-200 intron,
+    # "c" has two introns and "d" is unspliced but soft-clipped.
+    reads = [
+        ('a', 100, 0, [(0, 10), (3, 90), (0, 10)], [('XS', '+')]),
+        ('b', 105, 16, [(0, 5), (3, 90), (0, 15)], [('XS', '+')]),
+        ('c', 150, 16, [(0, 10), (2, 5), (3, 135), (0, 10), (3, 40),
+                        (0, 10)], []),
+        ('d', 320, 0, [(4, 5), (0, 20)], []),
+    ]
+    fn = _write_bam([
+        (name, pos, flag, -1, 0, cigar, tags)
+        for name, pos, flag, cigar, tags in reads])
+    signal = metaseq.genomic_signal(fn, 'bam')
+
+    x, y, junctions = signal.local_coverage('chr2L:1-500', junctions=True)
+    x2, y2 = signal.local_coverage('chr2L:1-500')
+    assert np.all(y == y2)
+    assert junctions.dtype == metaseq.filetype_adapters.junction_dtype
+    assert junctions.tolist() == [
+        (110, 200, '+', 2),
+        (165, 300, '-', 1),
+        (310, 350, '-', 1),
+    ], junctions
+
+    # only junctions overlapping the window are reported
+    x, y, junctions = signal.local_coverage('chr2L:301-320', junctions=True)
+    assert junctions.tolist() == [(310, 350, '-', 1)], junctions
+
+    # read filters apply to junctions too
+    x, y, junctions = signal.local_coverage(
+        'chr2L:1-500', junctions=True, exclude_flags=0x10)
+    assert junctions.tolist() == [(110, 200, '+', 1)], junctions
+
+    assert_raises(ArgumentError, signal.local_coverage, 'chr2L:1-500',
+                  junctions=True, paired_fragments=True)
+    assert_raises(ArgumentError, signal.array, ['chr2L:1-500'],
+                  junctions=True)
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, 'chr2L:1-500',
+                  junctions=True)
+
+
+def test_group_by_tag():
+    # (name, pos, flag, barcode); "GGG" is not one of the groups and "e" has
+    # no barcode
+    reads = [
+        ('a', 100, 0, 'AAA'),
+        ('b', 110, 16, 'CCC'),
+        ('c', 120, 0, 'AAA'),
+        ('d', 130, 0, 'GGG'),
+        ('e', 140, 0, None),
+        ('f', 300, 16, 'CCC'),
+    ]
+    fn = _write_bam([
+        (name, pos, flag, -1, 0, [(0, 20)],
+         [('CB', barcode)] if barcode else [])
+        for name, pos, flag, barcode in reads])
+    signal = metaseq.genomic_signal(fn, 'bam')
+    groups = ['AAA', 'CCC', 'TTT']
+
+    # each group matches what a BAM of only that group's reads would give
+    expected = {}
+    for group in groups:
+        names = set(r[0] for r in reads if r[3] == group)
+        single = metaseq.genomic_signal(_write_bam([
+            (name, pos, flag, -1, 0, [(0, 20)], [])
+            for name, pos, flag, barcode in reads if name in names]), 'bam')
+        expected[group] = single
+
+    features = ['chr2L:1-200', 'chr2L:101-400', 'chr2L:500-600']
+    kwargs = dict(bins=10, fragment_size=50, read_strand='-')
+    x, y = signal.local_coverage(
+        features[1], group_by_tag='CB', groups=groups, **kwargs)
+    assert y.shape == (3, 10)
+    for i, group in enumerate(groups):
+        x2, y2 = expected[group].local_coverage(features[1], **kwargs)
+        assert np.all(y[i] == y2)
+        assert np.all(x == x2)
+
+    arr = signal.array(features, group_by_tag='CB', groups=groups, bins=10)
+    assert arr.shape == (3, 3, 10)
+    for i, group in enumerate(groups):
+        assert np.all(arr[i] == expected[group].array(features, bins=10))
+
+    counts = signal.count_array(features, group_by_tag='CB', groups=groups)
+    assert counts.tolist() == [[2, 2, 0], [1, 2, 0], [0, 0, 0]], counts
+    counts = signal.count_array(
+        features, group_by_tag='CB', groups=groups, processes=2)
+    assert counts.tolist() == [[2, 2, 0], [1, 2, 0], [0, 0, 0]], counts
+    assert signal.count_array(features).tolist() == [5, 6, 0]
+
+    assert_raises(ArgumentError, signal.local_coverage, features[0],
+                  group_by_tag='CB')
+    assert_raises(ArgumentError, signal.local_coverage, features[0],
+                  group_by_tag='CB', groups=groups, split_strands=True)
+    assert_raises(ArgumentError, gs['bigbed'].local_coverage, features[0],
+                  group_by_tag='CB', groups=groups)
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, features[0],
+                  group_by_tag='CB', groups=groups)
+
+
+def test_cutsites():
+    # with symmetric offsets, cut sites are 1-bp fragments shifted 3'
+    for kind in ['bam', 'bigbed']:
+        for kwargs in [dict(), dict(bins=10), dict(split_strands=True),
+                       dict(read_strand='-', accumulate=False)]:
+            x, y = gs[kind].local_coverage(
+                'chr2L:1-200', mode='cutsites', cut_offsets=(3, -3),
+                **kwargs)
+            x2, y2 = gs[kind].local_coverage(
+                'chr2L:1-200', fragment_size=1, shift_width=3, **kwargs)
+            assert np.all(x == x2)
+            assert np.all(y == y2), (kind, kwargs, y, y2)
+
+    # (name, pos, flag, cigar); "b" is spliced, so its 5' end is after the
+    # intron
+    reads = [
+        ('a', 100, 0, [(0, 20)]),
+        ('b', 110, 16, [(0, 10), (3, 50), (0, 10)]),
+        ('c', 195, 16, [(0, 20)]),
+    ]
+    signal = metaseq.genomic_signal(_write_bam([
+        (name, pos, flag, -1, 0, cigar, [])
+        for name, pos, flag, cigar in reads]), 'bam')
+    x, y = signal.local_coverage('chr2L:100-210', mode='cutsites')
+    assert x[np.nonzero(y)[0]].tolist() == [104, 174, 209], x[y > 0]
+    x, y = signal.local_coverage(
+        'chr2L:100-210', mode='cutsites', cut_offsets=(0, 0))
+    assert x[np.nonzero(y)[0]].tolist() == [100, 179], x[y > 0]
+
+    assert_raises(ArgumentError, signal.local_coverage, 'chr2L:100-210',
+                  mode='cutsites', fragment_size=1)
+    assert_raises(ArgumentError, signal.local_coverage, 'chr2L:100-210',
+                  mode='cutsite')
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, 'chr2L:1-200',
+                  mode='cutsites')
+
+
+def test_subsample():
+    def check(kind):
+        signal = gs[kind]
+        x, full = signal.local_coverage('chr2L:1-1000')
+        x, y = signal.local_coverage('chr2L:1-1000', subsample=1)
+        assert np.all(y == full)
+
+        # the same reads are kept no matter how the region is split up
+        x, y = signal.local_coverage('chr2L:1-1000', subsample=0.5)
+        x1, y1 = signal.local_coverage('chr2L:1-500', subsample=0.5)
+        x2, y2 = signal.local_coverage('chr2L:500-1000', subsample=0.5)
+        assert np.all(y == np.concatenate([y1, y2]))
+        assert np.all(y <= 2 * full)
+
+        assert_raises(ArgumentError, signal.local_coverage, 'chr2L:1-1000',
+                      subsample=0)
+
+    for kind in ['bam', 'bed']:
+        check.description = 'subsampling %r' % kind
+        yield check, kind
+
+
+def test_subsample_bam():
+    signal = _random_bam_signal(0, 2000, span=9000, read_length=50)
+    features = ['chr2L:%s-%s' % (i, i + 1000) for i in range(1, 9000, 1000)]
+
+    full = signal.array(features, bins=10)
+    preview = signal.array(features, bins=10, subsample=0.1)
+    assert np.all(preview == signal.array(
+        features, bins=10, subsample=0.1, processes=2))
+
+    # scaled up to about the same total
+    assert abs(preview.sum() / full.sum() - 1) < 0.2
+
+    counts = signal.count_array(features, subsample=0.1)
+    assert abs(counts.sum() / signal.count_array(features).sum() - 1) < 0.2
+
+    assert np.all(preview == signal.array(
+        features, bins=10, target_reads=200))
+    assert np.all(full == signal.array(
+        features, bins=10, target_reads=5000))
+
+    assert_raises(ArgumentError, signal.array, features, bins=10,
+                  subsample=0.1, target_reads=200)
+    assert_raises(ArgumentError, gs['bigwig'].local_coverage, features[0],
+                  subsample=0.1)
+    # whether or not the features can be binned in a batch
+    for bigwig_features in [['chr2L:1-20', 'chr2L:21-40'],
+                            ['chr2L:1-20', 'chr2L:21-50']]:
+        for method in ['get_as_array', 'exact']:
+            assert_raises(ArgumentError, gs['bigwig'].array, bigwig_features,
+                          bins=4, method=method, subsample=0.1)
+    assert_raises(ArgumentError, gs['bigbed'].local_coverage, features[0],
+                  subsample=0.1)
+
+
+def test_merged_signal():
+    rng = np.random.RandomState(1)
+    positions = np.sort(rng.randint(0, 5000, 400))
+    reads = [
+        ('r%s' % i, pos, 16 * (i % 2), -1, 0, [(0, 30)], [])
+        for i, pos in enumerate(positions)]
+    combined = metaseq.genomic_signal(_write_bam(reads), 'bam')
+    replicates = [
+        metaseq.genomic_signal(_write_bam(reads[i::2]), 'bam')
+        for i in range(2)]
+    merged = metaseq.MergedSignal(replicates)
+    features = ['chr2L:%s-%s' % (i, i + 500) for i in range(1, 4500, 500)]
+
+    for kwargs in [dict(), dict(fragment_size=100), dict(split_strands=True),
+                   dict(accumulate=False), dict(read_strand='-'),
+                   dict(mode='cutsites'), dict(method='exact')]:
+        assert np.all(
+            merged.array(features, bins=20, **kwargs)
+            == combined.array(features, bins=20, **kwargs)), kwargs
+    assert np.all(merged.array(features, bins=20, processes=2)
+                  == combined.array(features, bins=20))
+    assert np.all(merged.count_array(features)
+                  == combined.count_array(features))
+
+    starts = [i.start for i in
+              merged.adapter[metaseq.helpers.tointerval(features[0])]]
+    assert starts == sorted(starts) and len(starts) > 0
+
+    # scaled to the average of the replicates
+    averaged = metaseq.MergedSignal(replicates, scale_factors=[0.5, 0.5])
+    assert np.allclose(
+        averaged.array(features, bins=20),
+        (replicates[0].array(features, bins=20)
+         + replicates[1].array(features, bins=20)) / 2.)
+    assert np.allclose(
+        averaged.count_array(features, stranded=False),
+        combined.count_array(features) / 2.)
+
+    # read filters of the signals are kept
+    filtered = metaseq.MergedSignal([
+        metaseq.genomic_signal(signal.fn, 'bam', exclude_flags=0x10)
+        for signal in replicates])
+    assert np.all(filtered.array(features, bins=20, processes=2)
+                  == combined.array(features, bins=20, read_strand='+'))
+
+    assert_raises(ValueError, metaseq.MergedSignal,
+                  [gs['bam'], gs['bigbed']])
+    assert_raises(ValueError, metaseq.MergedSignal, [gs['bigwig']])
+    assert_raises(ArgumentError, metaseq.MergedSignal, replicates,
+                  scale_factors=[1])
+    assert_raises(ArgumentError, merged.local_coverage, features[0],
+                  junctions=True)
+
+
+def test_array_normalize():
+    from metaseq import array_helpers
+    from metaseq.plotutils import nice_log
+    ip = _random_bam_signal(2, 300)
+    control = _random_bam_signal(12, 500)
+    signals = [ip, control]
+    features = ['chr2L:%s-%s' % (i, i + 500) for i in range(1, 4500, 500)]
+
+    ip_rpm = ip.array(features, bins=20) * 1e6 / 300
+    control_rpm = control.array(features, bins=20) * 1e6 / 500
+    assert np.allclose(
+        ip.array(features, bins=20, normalize='rpm'), ip_rpm)
+
+    # rows are normalized a chunk of features at a time, in the workers
+    chunksize = array_helpers._normalize_chunksize
+    array_helpers._normalize_chunksize = 2
+    try:
+        for processes in [None, 2]:
+            diffed = ip.array(
+                features, bins=20, normalize='rpm', control=control,
+                transform=nice_log, processes=processes)
+            assert np.allclose(diffed, nice_log(ip_rpm - control_rpm))
+    finally:
+        array_helpers._normalize_chunksize = chunksize
+
+    # the control's own read filters are used for its rows and read count,
+    # whichever signal has them
+    plus_control = metaseq.genomic_signal(control.fn, 'bam',
+                                          exclude_flags=0x10)
+    plus_ip = metaseq.genomic_signal(ip.fn, 'bam', exclude_flags=0x10)
+    assert plus_control.mapped_read_count() == 250
+    for processes in [None, 2]:
+        diffed = ip.array(features, bins=20, normalize='rpm',
+                          control=plus_control, processes=processes)
+        expected = ip_rpm - (
+            plus_control.array(features, bins=20) * 1e6 / 250)
+        assert np.allclose(diffed, expected)
+        diffed = plus_ip.array(features, bins=20, normalize='rpm',
+                               control=control, processes=processes)
+        expected = plus_ip.array(features, bins=20) * 1e6 / 150 - control_rpm
+        assert np.allclose(diffed, expected)
+
+    assert np.allclose(
+        ip.array(features, bins=20, control=control,
+                 comparefunc=np.add),
+        ip.array(features, bins=20) + control.array(features, bins=20))
+    assert np.allclose(
+        ip.array(features, bins=20, split_strands=True, normalize='rpm'),
+        ip.array(features, bins=20, split_strands=True) * 1e6 / 300)
+
+    merged = metaseq.MergedSignal(signals, scale_factors=[1, 0.5])
+    assert merged.mapped_read_count() == 550
+
+    assert_raises(ArgumentError, gs['bigbed'].array, features, bins=20,
+                  normalize='rpm')
+    assert_raises(ArgumentError, ip.array, features, bins=20,
+                  normalize='rpkm')
+
+
+def test_signal_comparison():
+    import tempfile
+    from metaseq.integration.signal_comparison import compare
+    signals = [_random_bam_signal(3, 300), _random_bam_signal(13, 500)]
+    features = [metaseq.helpers.tointerval('chr2L:%s-%s' % (i, i + 1000))
+                for i in range(0, 5000, 1000)]
+    outfn = os.path.join(tempfile.mkdtemp(), 'compared.bedgraph')
+    compare(signals[0], signals[1], features, outfn, batchsize=2,
+            array_kwargs=dict(bins=10))
+
+    expected = (signals[0].array(features, bins=10) * 1e6 / 300
+                - signals[1].array(features, bins=10) * 1e6 / 500)
+    lines = open(outfn).readlines()[1:]
+    assert len(lines) == (expected != 0).sum()
+    assert np.allclose(
+        [float(line.split()[3]) for line in lines],
+        expected[expected != 0])
+    assert set(int(line.split()[1]) // 1000 for line in lines) == set(
+        range(5))
+
+
+def test_lazy_array():
+    from metaseq.lazyarray import LazyArray
+    from metaseq.plotutils import nice_log
+    ip = _random_bam_signal(4, 300)
+    control = _random_bam_signal(14, 500)
+    features = ['chr2L:%s-%s' % (i, i + 500) for i in range(1, 4500, 500)]
+
+    for processes in [None, 2]:
+        lazy_ip = ip.array(features, bins=20, normalize='rpm', lazy=True,
+                           processes=processes)
+        lazy_control = control.array(features, bins=20, normalize='rpm',
+                                     lazy=True, processes=processes)
+        assert isinstance(lazy_ip, LazyArray)
+        assert lazy_ip.shape == (9, 20)
+        lazy_ip.chunksize = 4
+        eager_ip = ip.array(features, bins=20, normalize='rpm')
+        eager_control = control.array(features, bins=20, normalize='rpm')
+        assert np.allclose(lazy_ip.compute(), eager_ip)
+        assert np.allclose(np.asarray(lazy_ip), eager_ip)
+
+        logged = (lazy_ip - lazy_control).apply(nice_log)
+        expected = nice_log(eager_ip - eager_control)
+        assert np.allclose(logged.compute(), expected)
+        for reduction in ['sum', 'mean', 'min', 'max']:
+            for axis in [0, 1, None]:
+                assert np.allclose(
+                    getattr(logged, reduction)(axis=axis),
+                    getattr(expected, reduction)(axis=axis)), \
+                    (reduction, axis)
+
+        # selecting and re-ordering rows
+        order = np.argsort(logged.mean(axis=1))
+        assert np.allclose(logged[order].compute(), expected[order])
+        assert np.allclose(logged[order[-3:]].mean(axis=0),
+                           expected[order[-3:]].mean(axis=0))
+        assert np.allclose(logged[2], expected[2])
+        assert np.allclose(logged[-1], expected[-1])
+        assert np.allclose(logged[expected.sum(axis=1) > 0].compute(),
+                           expected[expected.sum(axis=1) > 0])
+
+    assert np.allclose((2 * lazy_ip + 1).compute(), 2 * eager_ip + 1)
+    assert np.allclose((1 - lazy_ip / 2).compute(), 1 - eager_ip / 2)
+    assert np.allclose((-lazy_ip).compute(), -eager_ip)
+    # 2-D arrays are split into the same chunks of rows
+    lazy_ip.chunksize = 4
+    offsets = np.arange(9 * 20).reshape(9, 20)
+    assert np.allclose((lazy_ip - offsets).compute(), eager_ip - offsets)
+    assert np.allclose((offsets * lazy_ip)[::-1].compute(),
+                       (offsets * eager_ip)[::-1])
+    assert np.allclose(lazy_ip.apply(np.add, offsets).compute(),
+                       eager_ip + offsets)
+    assert np.allclose((lazy_ip - offsets[:1]).compute(),
+                       eager_ip - offsets[:1])
+    assert_raises(ArgumentError, lambda: lazy_ip - offsets[:5])
+
+    assert_raises(ArgumentError, ip.array, features, lazy=True)
+    assert_raises(ArgumentError, ip.array, features, bins=20, lazy=True,
+                  split_strands=True)
+    assert_raises(ArgumentError, lambda: lazy_ip - lazy_ip[:3])
+
+
+def test_array_meanvar():
+    from metaseq.lazyarray import Metagene
+    from metaseq.plotutils import ci
+    signal = _random_bam_signal(5, 400)
+    features = ['chr2L:%s-%s' % (i, i + 500) for i in range(1, 4500, 250)]
+    labels = np.array(['a', 'b', 'c'] * 6)
+    arr = signal.array(features, bins=20, normalize='rpm')
+
+    for processes in [None, 2]:
+        metagene = signal.array(features, bins=20, normalize='rpm',
+                                reduce='meanvar', processes=processes)
+        assert isinstance(metagene, Metagene)
+        assert metagene.count == len(features)
+        assert np.allclose(metagene.mean, arr.mean(axis=0))
+        assert np.allclose(metagene.var, arr.var(axis=0))
+        assert np.allclose(metagene.sum, arr.sum(axis=0))
+        for i, j in zip(ci(metagene), ci(arr)):
+            assert np.allclose(i, j)
+
+        subsets = signal.array(features, bins=20, normalize='rpm',
+                               reduce='meanvar', subset_by=labels,
+                               processes=processes)
+        assert sorted(subsets) == ['a', 'b', 'c']
+        for label, metagene in subsets.items():
+            assert metagene.count == 6
+            assert np.allclose(metagene.mean,
+                               arr[labels == label].mean(axis=0))
+            assert np.allclose(metagene.std, arr[labels == label].std(axis=0))
+
+    assert_raises(ArgumentError, signal.array, features, bins=20,
+                  reduce='median')
+    assert_raises(ArgumentError, signal.array, features, bins=20,
+                  subset_by=labels)
+    assert_raises(ArgumentError, signal.array, features, bins=20,
+                  reduce='meanvar', subset_by=labels[:3])
+
+
+def _row_range(block):
+    return block.max(axis=1) - block.min(axis=1)
+
+
+def test_top_features():
+    from metaseq.plotutils import tip_zscores
+    signal = _random_bam_signal(6, 400)
+    features = ['chr2L:%s-%s' % (i, i + 300) for i in range(1, 4500, 100)]
+    arr = signal.array(features, bins=20)
+
+    def expected_order(scores):
+        return np.lexsort((np.arange(len(scores)), -scores))
+
+    for processes in [None, 2]:
+        for score, scores in [
+            ('sum', arr.sum(axis=1)),
+            ('max', arr.max(axis=1)),
+            ('tip', tip_zscores(arr)),
+            (_row_range, _row_range(arr)),
+        ]:
+            indices, rows = signal.top_features(
+                features, 7, score=score, bins=20, processes=processes)
+            assert np.all(rows == arr[indices]), score
+            if score == 'tip':
+                # different (but equivalent) floating-point order, so just
+                # check the selected set.
+                assert set(indices) == set(expected_order(scores)[:7])
+            else:
+                assert list(indices) == list(expected_order(scores)[:7]), \
+                    score
+
+    indices, rows = signal.top_features(features, 1000, bins=20)
+    assert rows.shape == arr.shape
+    assert sorted(indices) == range(len(features))
+    assert_raises(ArgumentError, signal.top_features, features, 5, bins=20,
+                  score='median')
+    assert_raises(ArgumentError, signal.top_features, features, 5)
+
+
+def _has_gap(row):
+    return (row == 0).any()
+
+
+def test_array_row_filters():
+    signal = _random_bam_signal(7, 200, span=2500)
+    features = ['chr2L:%s-%s' % (i, i + 300) for i in range(1, 4500, 150)]
+    arr = signal.array(features, bins=20)
+    plus, minus = signal.array(features, bins=20, split_strands=True)
+    assert (arr.sum(axis=1) == 0).any()
+
+    for kwargs in [dict(), dict(processes=2, chunksize=4)]:
+        indices, filtered = signal.array(features, bins=20, min_total=45,
+                                         **kwargs)
+        expected = np.nonzero(arr.sum(axis=1) >= 45)[0]
+        assert 0 < len(expected) < len(features)
+        assert list(indices) == list(expected)
+        assert np.all(filtered == arr[expected])
+
+        indices, filtered = signal.array(features, bins=20, min_max=6,
+                                         where=_has_gap, **kwargs)
+        expected = np.nonzero(
+            (arr.max(axis=1) >= 6) & (arr == 0).any(axis=1))[0]
+        assert list(indices) == list(expected)
+        assert np.all(filtered == arr[expected])
+
+        # each strand must pass
+        indices, (fplus, fminus) = signal.array(
+            features, bins=20, split_strands=True, min_total=15, **kwargs)
+        expected = np.nonzero(
+            (plus.sum(axis=1) >= 15) & (minus.sum(axis=1) >= 15))[0]
+        assert list(indices) == list(expected)
+        assert np.all(fplus == plus[expected])
+        assert np.all(fminus == minus[expected])
+
+        # normalization happens before filtering
+        indices, filtered = signal.array(
+            features, bins=20, normalize='rpm', min_total=2.5e5, **kwargs)
+        expected = np.nonzero(arr.sum(axis=1) * 1e6 / 200 >= 2.5e5)[0]
+        assert list(indices) == list(expected)
+
+        indices, filtered = signal.array(features, bins=20, min_total=1e9,
+                                         **kwargs)
+        assert len(indices) == 0
+        assert filtered.shape == (0, 20)
+
+    assert_raises(ArgumentError, signal.array, features, bins=20,
+                  min_total=1, lazy=True)
+
+
+def test_xcorr():
+    from metaseq.integration.chipseq import xcorr
+    rng = np.random.RandomState(8)
+    for n, maxlag in [(50, 10), (300, 40), (7, 0)]:
+        x = rng.poisson(2, (5, n)).astype(float)
+        y = rng.poisson(2, (5, n)).astype(float)
+        batched = xcorr(x, y, maxlag)
+        assert batched.shape == (5, 2 * maxlag + 1)
+        for i in range(5):
+            c = np.correlate(x[i], y[i], mode=2)
+            c /= np.sqrt(np.dot(x[i], x[i]) * np.dot(y[i], y[i]))
+            expected = c[n - 1 - maxlag:n + maxlag]
+            assert np.allclose(batched[i], expected)
+            assert np.allclose(xcorr(x[i], y[i], maxlag), expected)
+
+
 def test_bam_mmr():
     import os
     assert gs['bam'].mapped_read_count(force=True) == 8
     gs['bam']._readcount = None
     assert gs['bam'].mapped_read_count(force=False) == 8, gs['bam'].mapped_read_count(force=False)
 
+    # stale or old-style cached counts are ignored
+    mmr = gs['bam'].fn + '.mmr'
+    fout = open(mmr, 'w')
+    fout.write('100\n0\t0\t0\t0\t4\tFalse\t100\n')
+    fout.close()
+    gs['bam']._readcount = None
+    assert gs['bam'].mapped_read_count() == 8
+    os.unlink(mmr)
+
+    # filtered counts
+    assert gs['bam'].mapped_read_count(exact=True) == 8
+    assert gs['bam'].mapped_read_count(exclude_flags=0x14) == 5
+    assert gs['bam'].mapped_read_count(require_flags=0x10, processes=2) == 3
+    assert gs['bam'].mapped_read_count(min_mapq=256) == 0
+    assert gs['bam'].mapped_read_count() == 8
+    os.unlink(mmr)
+
 def test_bigwig_out_of_range():
     x, y = gs['bigwig'].local_coverage('chr1:1-100', bins=None)
     assert y.sum() == 0